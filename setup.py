@@ -7,7 +7,7 @@ setup(name='seqdiag_gui',
       author_email='luis.osa.gdc@gmail.com',
       url='https://github.com/logc/seqdiag_gui',
       package_dir={'': 'src'},
-      packages=['seqdiag_gui'],
+      packages=['seqdiag_gui', 'seqdiag_gui.benchmarks'],
       install_requires=[
           'seqdiag==0.8.2',
           ## 'wxPython==2.9.4.0',
@@ -15,5 +15,12 @@ setup(name='seqdiag_gui',
       entry_points={
           'console_scripts': [
               'seqdiag_gui=seqdiag_gui.main:run',
+              'seqdiag_gui-batch=seqdiag_gui.batch:run',
+              'seqdiag_gui-server=seqdiag_gui.server:run',
+              'seqdiag_gui-import=seqdiag_gui.traces:run',
+              'seqdiag_gui-diff=seqdiag_gui.diffing:run',
+              'seqdiag_gui-bench=seqdiag_gui.benchmarks.harness:run',
+              'seqdiag_gui-bench-bands=seqdiag_gui.benchmarks.bands:run',
+              'seqdiag_gui-bench-model=seqdiag_gui.benchmarks.model:run',
           ]}
       )
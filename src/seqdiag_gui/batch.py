@@ -0,0 +1,128 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    batch.py
+Author:
+    Luis Osa <logc>
+Description:
+    Headless batch renderer. Renders every diagram source under a directory
+    tree on a pool of processes. This module must not import wx, so that it
+    can run on machines without a display.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import seqdiagrams
+
+SOURCE_EXTENSION = '.diag'
+
+
+def find_sources(root, extension=SOURCE_EXTENSION):
+    """Yields the path of every diagram source under `root`"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(extension):
+                yield os.path.join(dirpath, filename)
+
+
+def output_path(source, root, output_dir=None):
+    """Returns the image path for a source, mirroring the source tree under
+    `output_dir` when one is given"""
+    base = os.path.splitext(source)[0] + '.' + seqdiagrams.FORMAT.lower()
+    if output_dir is None:
+        return base
+    return os.path.join(output_dir, os.path.relpath(base, root))
+
+
+def is_up_to_date(source, target):
+    """Returns whether `target` exists and is newer than `source`"""
+    return (os.path.exists(target) and
+            os.path.getmtime(target) >= os.path.getmtime(source))
+
+
+def render_file(job):
+    """Renders one source into its target image. Returns the source, the
+    elapsed time and an error message, which is None on success."""
+    source, target = job
+    start = time.time()
+    try:
+        with open(source, 'r') as textfile:
+            img = seqdiagrams.text2png(textfile.read())
+        if img is None:
+            error = 'not a valid sequence diagram'
+        else:
+            target_dir = os.path.dirname(target)
+            if target_dir and not os.path.isdir(target_dir):
+                os.makedirs(target_dir)
+            with open(target, 'wb') as imgfile:
+                imgfile.write(img)
+            error = None
+    except Exception as exception:
+        error = '{0}: {1}'.format(type(exception).__name__, exception)
+    return source, time.time() - start, error
+
+
+def build_parser():
+    """Builds the command line parser of the batch renderer"""
+    parser = argparse.ArgumentParser(
+        prog='seqdiag_gui-batch',
+        description='Render every .diag file under a directory tree.')
+    parser.add_argument('root', help='directory to search for sources')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='write images here instead of next to sources')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of rendering processes')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='render sources even if their image is newer')
+    return parser
+
+
+def run(argv=None):
+    """Batch renderer entry point"""
+    options = build_parser().parse_args(argv)
+    jobs, skipped = [], 0
+    for source in find_sources(options.root):
+        target = output_path(source, options.root, options.output_dir)
+        if not options.force and is_up_to_date(source, target):
+            skipped += 1
+        else:
+            jobs.append((source, target))
+    failures = 0
+    start = time.time()
+    pool = multiprocessing.Pool(max(1, options.jobs))
+    try:
+        for source, elapsed, error in pool.imap_unordered(render_file, jobs):
+            if error is None:
+                print '{0:8.3f}s  {1}'.format(elapsed, source)
+            else:
+                failures += 1
+                print '{0:8.3f}s  {1}  FAILED: {2}'.format(
+                    elapsed, source, error)
+    finally:
+        pool.close()
+        pool.join()
+    print '{0} rendered, {1} failed, {2} up to date in {3:.3f}s'.format(
+        len(jobs) - failures, failures, skipped, time.time() - start)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,9 @@
+"""
+Package seqdiag_gui.benchmarks
+
+Benchmarks of the rendering pipeline. The generator module builds synthetic
+diagram sources of any size, and the harness module times every rendering
+stage on them and compares results between runs. The bands module measures
+how drawing in parallel bands scales with the number of bands, and the model
+module the memory a render state keeps of a diagram.
+"""
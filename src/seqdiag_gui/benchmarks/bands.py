@@ -0,0 +1,119 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    bands.py
+Author:
+    Luis Osa <logc>
+Description:
+    Measures how drawing a diagram in parallel bands scales with the number
+    of bands, against drawing it at once, and checks that both give the same
+    pixels.
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from collections import OrderedDict
+
+from seqdiag_gui import fonts, seqdiagrams
+from generator import generate
+
+DEFAULT_BANDS = (1, 2, 4, 8, 16)
+
+
+def best_time(function, repeat):
+    """Returns the fastest of `repeat` calls to a function, and its result"""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_bands(text, band_counts, repeat=3):
+    """Times drawing a text at once and in each number of bands, and returns
+    the results as a JSON-friendly value"""
+    ## measures texts afresh, without the user's saved measurements
+    fonts.METRICS.directory = None
+    seqdiagrams.load()
+    serial, expected = best_time(
+        lambda: seqdiagrams.diagram2raster(seqdiagrams.text2diagram(text)),
+        repeat)
+    results = OrderedDict([('serial_s', serial),
+                           ('size', [expected.width, expected.height]),
+                           ('bands', [])])
+    for bands in band_counts:
+        pool = multiprocessing.Pool(bands, initializer=seqdiagrams.load)
+        try:
+            ## the first call pays for starting up the processes
+            seqdiagrams.text2raster_bands(text, bands, pool=pool)
+            elapsed, raster = best_time(
+                lambda: seqdiagrams.text2raster_bands(text, bands, pool=pool),
+                repeat)
+        finally:
+            pool.close()
+            pool.join()
+        results['bands'].append(OrderedDict([
+            ('bands', bands), ('seconds', elapsed),
+            ('speedup', serial / elapsed if elapsed else None),
+            ('identical', raster == expected)]))
+    return results
+
+
+def build_parser():
+    """Builds the command line parser of the band benchmark"""
+    parser = argparse.ArgumentParser(
+        prog='seqdiag_gui-bench-bands',
+        description='Time drawing a diagram in parallel bands.')
+    parser.add_argument('--participants', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--bands', type=int, nargs='+',
+                        default=list(DEFAULT_BANDS),
+                        help='numbers of bands to try')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measure; the fastest one counts')
+    parser.add_argument('-o', '--output', default=None,
+                        help='write the results to this JSON file')
+    return parser
+
+
+def run(argv=None):
+    """Band benchmark entry point. Exits with an error status if any number
+    of bands gives different pixels than drawing at once."""
+    options = build_parser().parse_args(argv)
+    text = generate(participants=options.participants,
+                    messages=options.messages)
+    results = run_bands(text, options.bands, max(1, options.repeat))
+    print 'serial: {0:.3f}s for {1}x{2} pixels'.format(
+        results['serial_s'], *results['size'])
+    print '{0:>6} {1:>9} {2:>8} {3:>10}'.format('bands', 'seconds',
+                                                'speedup', 'identical')
+    for result in results['bands']:
+        print '{0:>6} {1:9.3f} {2:8.2f} {3:>10}'.format(
+            result['bands'], result['seconds'], result['speedup'],
+            result['identical'])
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    return 0 if all(result['identical'] for result in results['bands']) \
+        else 1
+
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,85 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    generator.py
+Author:
+    Luis Osa <logc>
+Description:
+    Generates synthetic seqdiag sources. The same parameters and seed always
+    produce the same source, so that runs of a benchmark can be compared.
+"""
+import random
+import string
+
+INDENT = '  '
+
+
+def participant_names(count):
+    """Returns `count` distinct participant names"""
+    return ['participant{0}'.format(index) for index in range(count)]
+
+
+def random_label(rng, length):
+    """Returns a label of `length` characters made of short words"""
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(''.join(rng.choice(string.ascii_lowercase)
+                             for _ in range(rng.randint(2, 8))))
+    return ' '.join(words)[:length].strip()
+
+
+def generate(participants=5, messages=50, depth=1, label_length=12,
+             groups=0, seed=0):
+    """Returns the source of a diagram with the given number of participants
+    and messages. Messages nest into blocks up to `depth` levels deep, and
+    `groups` groups gather neighbouring participants."""
+    rng = random.Random(seed)
+    names = participant_names(max(2, participants))
+    lines = ['diagram {']
+    for name in names:
+        lines.append('{0}{1};'.format(INDENT, name))
+    for index in range(groups):
+        start = index * len(names) // max(1, groups)
+        members = names[start:start + max(1, len(names) // max(1, groups))]
+        lines.append('{0}group {{ {1}; }}'.format(INDENT, '; '.join(members)))
+    emitted = 0
+    while emitted < messages:
+        emitted += _emit_block(lines, rng, names, messages - emitted,
+                               depth, label_length, 1)
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def _emit_block(lines, rng, names, budget, depth, label_length, level):
+    """Appends one message, with a nested block of messages below it while
+    `depth` allows, and returns how many messages were appended"""
+    sender, receiver = rng.sample(names, 2)
+    label = random_label(rng, label_length)
+    prefix = INDENT * level
+    if depth <= 1 or budget < 2:
+        lines.append('{0}{1} -> {2} [label = "{3}"];'.format(
+            prefix, sender, receiver, label))
+        return 1
+    lines.append('{0}{1} => {2} [label = "{3}"] {{'.format(
+        prefix, sender, receiver, label))
+    emitted = 1
+    for _ in range(rng.randint(1, 3)):
+        if emitted >= budget:
+            break
+        emitted += _emit_block(lines, rng, names, budget - emitted,
+                               depth - 1, label_length, level + 1)
+    lines.append(prefix + '}')
+    return emitted
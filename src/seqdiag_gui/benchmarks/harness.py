@@ -0,0 +1,195 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    harness.py
+Author:
+    Luis Osa <logc>
+Description:
+    Times each stage of the rendering pipeline (parse, build, draw and save)
+    on synthetic diagrams, records the peak memory of every case, writes the
+    results as JSON and compares them with the results of an earlier run.
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from collections import OrderedDict
+
+from seqdiag_gui import fonts, seqdiagrams
+from generator import generate
+
+STAGES = ('parse', 'build', 'draw', 'save')
+DEFAULT_THRESHOLD = 0.10
+
+SUITES = {
+    'quick': [
+        dict(participants=5, messages=50),
+        dict(participants=10, messages=200, depth=2),
+    ],
+    'full': [
+        dict(participants=participants, messages=messages, depth=depth,
+             label_length=label_length, groups=groups)
+        for participants, messages in ((5, 50), (20, 200), (50, 1000))
+        for depth in (1, 3)
+        for label_length, groups in ((12, 0), (60, 4))
+    ],
+}
+
+
+def case_name(params):
+    """Returns a stable name for a benchmark case"""
+    return ','.join('{0}={1}'.format(key, params[key])
+                    for key in sorted(params))
+
+
+def time_stages(text):
+    """Runs the rendering pipeline once on a text and returns the time spent
+    in each stage"""
+    seqdiagrams.load()
+    timings = OrderedDict()
+    start = time.time()
+    tree = seqdiagrams.parser.parse_string(text)
+    timings['parse'] = time.time() - start
+    start = time.time()
+    diagram = seqdiagrams.ScreenNodeBuilder.build(tree)
+    timings['build'] = time.time() - start
+    start = time.time()
+    drawer = seqdiagrams.DiagramDraw(seqdiagrams.FORMAT, diagram,
+                                     font=seqdiagrams.FONTPATH,
+                                     antialias=seqdiagrams.ANTIALIAS,
+                                     transparency=True)
+    drawer.draw()
+    timings['draw'] = time.time() - start
+    start = time.time()
+    drawer.save()
+    timings['save'] = time.time() - start
+    return timings
+
+
+def run_case(job):
+    """Benchmarks one case. Meant to run in a fresh process, so that the
+    peak resident size it reports belongs to this case alone."""
+    params, repeat = job
+    text = generate(**params)
+    runs = [time_stages(text) for _ in range(repeat)]
+    stages = OrderedDict()
+    for stage in STAGES:
+        samples = sorted(run[stage] for run in runs)
+        stages[stage] = {'min': samples[0],
+                         'median': samples[len(samples) // 2]}
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return OrderedDict([('name', case_name(params)), ('params', params),
+                        ('source_bytes', len(text)), ('stages', stages),
+                        ('peak_rss_kb', peak)])
+
+
+def run_suite(cases, repeat=3):
+    """Benchmarks every case, each in its own process, and returns the
+    results as a JSON-friendly value"""
+    ## keeps the text measurements of this run in memory, so that earlier
+    ## runs do not warm it up and it leaves the user's own ones alone
+    fonts.METRICS.directory = None
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        results = pool.map(run_case, [(params, repeat) for params in cases],
+                           chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return OrderedDict([
+        ('meta', {'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'repeat': repeat,
+                  'time': time.strftime('%Y-%m-%dT%H:%M:%S')}),
+        ('cases', results)])
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Returns the regressions of `current` against `baseline`, as a list of
+    (case, measure, baseline value, current value). A measure regresses when
+    it grows by more than `threshold`, relative to the baseline."""
+    previous = dict((case['name'], case) for case in baseline['cases'])
+    regressions = []
+    for case in current['cases']:
+        old = previous.get(case['name'])
+        if old is None:
+            continue
+        measures = [(stage, old['stages'][stage]['min'],
+                     case['stages'][stage]['min'])
+                    for stage in STAGES if stage in old['stages']]
+        measures.append(('peak_rss_kb', old['peak_rss_kb'],
+                         case['peak_rss_kb']))
+        for measure, before, after in measures:
+            if before > 0 and (after - before) / float(before) > threshold:
+                regressions.append((case['name'], measure, before, after))
+    return regressions
+
+
+def print_results(results):
+    """Prints a table of the minimum time of each stage per case"""
+    print '{0:<60} {1}  {2:>10}'.format(
+        'case', '  '.join('{0:>8}'.format(stage) for stage in STAGES),
+        'peak KB')
+    for case in results['cases']:
+        print '{0:<60} {1}  {2:>10}'.format(
+            case['name'],
+            '  '.join('{0:8.4f}'.format(case['stages'][stage]['min'])
+                      for stage in STAGES),
+            case['peak_rss_kb'])
+
+
+def build_parser():
+    """Builds the command line parser of the benchmark harness"""
+    parser = argparse.ArgumentParser(
+        prog='seqdiag_gui-bench',
+        description='Time the stages of rendering synthetic diagrams.')
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per case; the fastest one is compared')
+    parser.add_argument('-o', '--output', default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', default=None,
+                        help='report regressions against an earlier result')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative growth that counts as a regression')
+    return parser
+
+
+def run(argv=None):
+    """Benchmark harness entry point"""
+    options = build_parser().parse_args(argv)
+    results = run_suite(SUITES[options.suite], max(1, options.repeat))
+    print_results(results)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if options.compare:
+        with open(options.compare) as baseline:
+            regressions = compare(json.load(baseline), results,
+                                  options.threshold)
+        for name, measure, before, after in regressions:
+            print 'REGRESSION {0} {1}: {2:.4f} -> {3:.4f}'.format(
+                name, measure, before, after)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
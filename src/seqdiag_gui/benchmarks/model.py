@@ -0,0 +1,123 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    model.py
+Author:
+    Luis Osa <logc>
+Description:
+    Measures the memory a render state keeps of a diagram between renders:
+    the seqdiag diagram against its compact model, for diagrams of growing
+    size, and how long building the model takes.
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import types
+from collections import OrderedDict
+
+from seqdiag_gui import fonts, seqdiagrams
+from generator import generate
+
+DEFAULT_MESSAGES = (1000, 5000, 10000)
+## objects shared by every diagram, which a diagram does not own
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType,
+                types.BuiltinFunctionType, types.MethodType,
+                types.ClassType)
+
+
+def deep_size(root):
+    """Returns the bytes taken by an object and every object it reaches,
+    counting each once and leaving out classes, modules and functions"""
+    seen = set()
+    pending = [root]
+    total = 0
+    while pending:
+        value = pending.pop()
+        if id(value) in seen or isinstance(value, SHARED_TYPES):
+            continue
+        seen.add(id(value))
+        total += sys.getsizeof(value)
+        pending.extend(gc.get_referents(value))
+    return total
+
+
+def measure(text):
+    """Returns the bytes taken by the seqdiag diagram of a text and by its
+    compact model, and the time to build the model"""
+    diagram = seqdiagrams.text2diagram(text)
+    ## measures the labels, as the model expects
+    seqdiagrams.new_drawer(diagram)
+    start = time.time()
+    model = seqdiagrams.CompactDiagram(diagram)
+    build = time.time() - start
+    return OrderedDict([('edges', len(diagram.edges)),
+                        ('diagram_bytes', deep_size(diagram)),
+                        ('model_bytes', deep_size(model)),
+                        ('build_s', build)])
+
+
+def run_model(message_counts, participants=20):
+    """Measures diagrams of each number of messages, and returns the results
+    as a JSON-friendly value"""
+    ## neither reads nor writes the user's saved text measurements
+    fonts.METRICS.directory = None
+    seqdiagrams.load()
+    results = []
+    for messages in message_counts:
+        result = measure(generate(participants=participants,
+                                  messages=messages))
+        result['messages'] = messages
+        result['saving'] = 1 - result['model_bytes'] / \
+            float(result['diagram_bytes'])
+        results.append(result)
+    return results
+
+
+def build_parser():
+    """Builds the command line parser of the model benchmark"""
+    parser = argparse.ArgumentParser(
+        prog='seqdiag_gui-bench-model',
+        description='Measure the memory of the compact diagram model.')
+    parser.add_argument('--participants', type=int, default=20)
+    parser.add_argument('--messages', type=int, nargs='+',
+                        default=list(DEFAULT_MESSAGES),
+                        help='numbers of messages to try')
+    parser.add_argument('-o', '--output', default=None,
+                        help='write the results to this JSON file')
+    return parser
+
+
+def run(argv=None):
+    """Model benchmark entry point"""
+    options = build_parser().parse_args(argv)
+    results = run_model(options.messages, options.participants)
+    print '{0:>8} {1:>12} {2:>12} {3:>7} {4:>8}'.format(
+        'messages', 'diagram KB', 'model KB', 'saving', 'build s')
+    for result in results:
+        print '{0:>8} {1:12.0f} {2:12.0f} {3:6.1%} {4:8.3f}'.format(
+            result['messages'], result['diagram_bytes'] / 1024.0,
+            result['model_bytes'] / 1024.0, result['saving'],
+            result['build_s'])
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
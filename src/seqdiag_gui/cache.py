@@ -0,0 +1,208 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    cache.py
+Author:
+    Luis Osa <logc>
+Description:
+    A content-addressed cache for rendered diagrams. Entries live in a
+    size-limited in-memory LRU tier and, optionally, in a size-limited
+    on-disk tier under a cache directory.
+"""
+import cPickle
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+CACHE_EXTENSION = '.cache'
+
+
+def cache_key(text, *options):
+    """Returns a hex digest identifying a source text rendered with the given
+    options. Line endings and trailing blanks do not change the key."""
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    normalized = '\n'.join(line.rstrip() for line in lines).strip()
+    if isinstance(normalized, unicode):
+        normalized = normalized.encode('utf-8')
+    digest = hashlib.sha1(normalized)
+    for option in options:
+        digest.update('\0')
+        digest.update(repr(option))
+    return digest.hexdigest()
+
+
+class RenderCache(object):
+    """Maps cache keys to rendered images. The memory tier evicts the least
+    recently used entries once `max_bytes` is exceeded; the disk tier, when a
+    `directory` is given, evicts the files read or written longest ago once
+    they take more than `max_disk_bytes`."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, directory=None,
+                 sizeof=len, max_disk_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.sizeof = sizeof
+        self.max_disk_bytes = max_disk_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        ## bytes written to the disk tier, counted from a listing of it on
+        ## the first write; other processes may share the directory, so the
+        ## listing is taken again before evicting
+        self._disk_bytes = None
+        self._disk_lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.directory is not None and os.path.exists(self._path(key))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the entry for `key`, looking first in memory and then on
+        disk. Disk hits are promoted to the memory tier."""
+        with self._lock:
+            if key in self._entries:
+                value = self._entries.pop(key)
+                self._entries[key] = value
+                self.hits += 1
+                return value
+        value = self._load(key)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        """Stores `value` under `key` in every tier"""
+        self._remember(key, value)
+        self._store(key, value)
+
+    def clear(self):
+        """Empties the memory tier and removes every file of the disk tier"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(CACHE_EXTENSION):
+                    os.remove(os.path.join(self.directory, name))
+        with self._disk_lock:
+            self._disk_bytes = None
+
+    def _remember(self, key, value):
+        """Adds an entry to the memory tier, evicting old ones if needed"""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self.sizeof(self._entries.pop(key))
+            self._entries[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self.sizeof(evicted)
+
+    def _path(self, key):
+        """Returns the disk tier file name for a key"""
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def _load(self, key):
+        """Reads an entry from the disk tier, or None if absent. The file is
+        touched, so that it is evicted after the ones not read since."""
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cachefile:
+                value = cPickle.load(cachefile)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def _store(self, key, value):
+        """Writes an entry to the disk tier. The file is written under a
+        temporary name first, so readers never see half an entry."""
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        handle, tmpname = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as cachefile:
+                cPickle.dump(value, cachefile, cPickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(tmpname)
+            os.rename(tmpname, self._path(key))
+            tmpname = None
+        finally:
+            ## a failed write leaves no stray file behind
+            if tmpname is not None:
+                os.remove(tmpname)
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._files())
+            else:
+                self._disk_bytes += size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_files()
+
+    def _files(self):
+        """Returns the path, size and last use time of every file of the disk
+        tier"""
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_EXTENSION):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict_files(self):
+        """Removes the files of the disk tier used longest ago until the rest
+        fit in `max_disk_bytes`"""
+        files = sorted(self._files(), key=lambda entry: entry[2])
+        self._disk_bytes = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    continue
+            self._disk_bytes -= size
@@ -0,0 +1,211 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    canvas.py
+Author:
+    Luis Osa <logc>
+Description:
+    A scrolled canvas that shows a rendered diagram as a grid of tiles. Only
+    the tiles around the visible area are turned into bitmaps, so very large
+    diagrams never need one bitmap of their full size.
+"""
+from collections import OrderedDict
+
+import wx
+
+import seqdiagrams
+from handlers import raster2bitmap
+
+TILE_SIZE = 256
+PREFETCH_TILES = 1
+MAX_TILES = 192
+ZOOM_LEVELS = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0)
+SCROLL_RATE = 20
+PLACEHOLDER = 'Rendering diagram...'
+
+
+class TiledCanvas(wx.ScrolledWindow):
+    """Shows a raster at a zoom level, building tiles on demand and keeping
+    at most MAX_TILES of them, least recently painted first out. A
+    placeholder text is shown until the first raster arrives."""
+
+    def __init__(self, parent, size=wx.DefaultSize):
+        super(TiledCanvas, self).__init__(
+            parent, -1, size=size, style=wx.HSCROLL | wx.VSCROLL)
+        self.SetBackgroundStyle(wx.BG_STYLE_CUSTOM)
+        self.SetScrollRate(SCROLL_RATE, SCROLL_RATE)
+        self.raster = None
+        self.image = None
+        self.zoom = 1.0
+        ## pixels of the raster per pixel of the full render
+        self.scale = 1.0
+        self._tiles = OrderedDict()
+        self.Bind(wx.EVT_PAINT, self.on_paint)
+        self.Bind(wx.EVT_MOUSEWHEEL, self.on_mousewheel)
+
+    def set_raster(self, raster, boxes=None, scale=1.0):
+        """Shows a new raster. If `boxes` lists the regions that changed since
+        the previous raster, only the tiles under them are rebuilt. A raster
+        drawn at a `scale` below 1, such as a preview, is stretched to the
+        size of the full render."""
+        same_size = (self.raster is not None and self.scale == scale and
+                     (self.raster.width, self.raster.height) ==
+                     (raster.width, raster.height))
+        self.raster = raster
+        self.scale = scale
+        self.image = seqdiagrams.raster2image(raster)
+        if boxes is None or not same_size:
+            self._tiles.clear()
+            self._update_virtual_size()
+            self.Refresh()
+            return
+        for box in boxes:
+            rect = self._zoomed_rect(box)
+            for key in self._tiles.keys():
+                if self._tile_rect(*key).Intersects(rect):
+                    del self._tiles[key]
+            rect.SetPosition(self.CalcScrolledPosition(rect.GetPosition()))
+            self.RefreshRect(rect)
+
+    def clear(self):
+        """Forgets the raster and every tile, showing the placeholder until a
+        raster is set again"""
+        self.raster = None
+        self.image = None
+        self.scale = 1.0
+        self._tiles.clear()
+        self._update_virtual_size()
+        self.Refresh()
+
+    def tile_bytes(self):
+        """Returns the approximate memory held by the tile cache"""
+        return sum(bitmap.GetWidth() * bitmap.GetHeight() * 4
+                   for bitmap in self._tiles.values())
+
+    def set_zoom(self, zoom):
+        """Shows the current raster at another zoom level. Only the tiles are
+        scaled; the diagram is not laid out nor drawn again."""
+        if zoom == self.zoom:
+            return
+        self.zoom = zoom
+        self._tiles.clear()
+        self._update_virtual_size()
+        self.Refresh()
+
+    def zoom_in(self):
+        """Moves to the next larger zoom level"""
+        larger = [level for level in ZOOM_LEVELS if level > self.zoom]
+        if larger:
+            self.set_zoom(larger[0])
+
+    def zoom_out(self):
+        """Moves to the next smaller zoom level"""
+        smaller = [level for level in ZOOM_LEVELS if level < self.zoom]
+        if smaller:
+            self.set_zoom(smaller[-1])
+
+    def on_mousewheel(self, event):
+        """Zooms with the mouse wheel while the control key is held down"""
+        if not event.ControlDown():
+            event.Skip()
+        elif event.GetWheelRotation() > 0:
+            self.zoom_in()
+        else:
+            self.zoom_out()
+
+    def on_paint(self, event):
+        """Paints the visible tiles, building the ones that are missing as
+        well as those within the prefetch margin"""
+        dc = wx.AutoBufferedPaintDC(self)
+        self.DoPrepareDC(dc)
+        dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+        dc.Clear()
+        if self.raster is None:
+            width, height = self.GetClientSize()
+            text_width, text_height = dc.GetTextExtent(PLACEHOLDER)
+            dc.DrawText(PLACEHOLDER, (width - text_width) // 2,
+                        (height - text_height) // 2)
+            return
+        left, top = self.CalcUnscrolledPosition(0, 0)
+        width, height = self.GetClientSize()
+        visible = wx.Rect(left, top, width, height)
+        first_col, last_col = self._tile_span(left, width, self._zoomed(
+            self.raster.width))
+        first_row, last_row = self._tile_span(top, height, self._zoomed(
+            self.raster.height))
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                bitmap = self._tile(col, row)
+                if bitmap is not None and \
+                        self._tile_rect(col, row).Intersects(visible):
+                    dc.DrawBitmap(bitmap, col * TILE_SIZE, row * TILE_SIZE,
+                                  True)
+
+    def _zoomed(self, length):
+        """Returns a length of the raster as seen at the current zoom"""
+        return int(round(length * self.zoom / self.scale))
+
+    def _zoomed_rect(self, box):
+        """Returns the zoomed rectangle of a box (x1, y1, x2, y2)"""
+        x1, y1, x2, y2 = [self._zoomed(value) for value in box]
+        return wx.Rect(x1, y1, max(1, x2 - x1), max(1, y2 - y1))
+
+    def _tile_span(self, start, length, limit):
+        """Returns the first and last tile indices covering a visible span,
+        widened by the prefetch margin"""
+        last_tile = max(0, (limit - 1) // TILE_SIZE)
+        first = max(0, start // TILE_SIZE - PREFETCH_TILES)
+        last = min(last_tile, (start + length) // TILE_SIZE + PREFETCH_TILES)
+        return first, last
+
+    def _tile_rect(self, col, row):
+        """Returns the zoomed rectangle covered by a tile"""
+        return wx.Rect(col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+
+    def _tile(self, col, row):
+        """Returns the bitmap of a tile, building it from the raster if it is
+        not in the tile cache"""
+        key = (col, row)
+        if key in self._tiles:
+            bitmap = self._tiles.pop(key)
+            self._tiles[key] = bitmap
+            return bitmap
+        width = min(TILE_SIZE, self._zoomed(self.raster.width) -
+                    col * TILE_SIZE)
+        height = min(TILE_SIZE, self._zoomed(self.raster.height) -
+                     row * TILE_SIZE)
+        if width <= 0 or height <= 0:
+            return None
+        box = [int(value * self.scale / self.zoom) for value in (
+            col * TILE_SIZE, row * TILE_SIZE,
+            col * TILE_SIZE + width, row * TILE_SIZE + height)]
+        tile = self.image.crop(box)
+        if tile.size != (width, height):
+            tile = tile.resize((width, height), seqdiagrams.Image.BILINEAR)
+        tobytes = getattr(tile, 'tobytes', None) or tile.tostring
+        bitmap = raster2bitmap(seqdiagrams.Raster(width, height, tobytes()))
+        self._tiles[key] = bitmap
+        while len(self._tiles) > MAX_TILES:
+            self._tiles.popitem(last=False)
+        return bitmap
+
+    def _update_virtual_size(self):
+        """Sets the scrollable area to the zoomed size of the raster"""
+        if self.raster is None:
+            self.SetVirtualSize((0, 0))
+        else:
+            self.SetVirtualSize((self._zoomed(self.raster.width),
+                                 self._zoomed(self.raster.height)))
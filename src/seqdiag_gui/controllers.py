@@ -23,30 +23,191 @@ Description:
     This module holds all Controllers. Controllers mediate the effects of user
     actions on the Models.
 """
+import codecs
+import io
 import os.path
 
 import wx
 
 import handlers
-from windows import MainWindow, DocWindow
+from batch import output_path
+from diffing import describe as describe_diff, diff_raster
+from documents import Document, MemoryBudget
+from export import EXPORT_WILDCARD, export_format
+from instrumentation import INSTRUMENTS
+from journal import (Journal, JournalWriter, recover, remove_journal,
+                     text_delta, write_changes)
+from loading import DocumentLoader, LoadError
+from server import RenderClient, RenderServerError
+from traces import default_output_dir, window_path
+from windows import MainWindow, DocWindow, START_DIAG
+from watcher import Watcher
+from scheduler import RenderScheduler
+from workers import ImportWorker
+
+DEBOUNCE_MS = 300
+JOURNAL_MS = 1000
+NEW_DIAG = 'diagram {\n}\n'
+TRACE_WILDCARD = ('JSON lines trace (*.jsonl)|*.jsonl|'
+                  'All files (*.*)|*.*')
 
 
 class MainController(object):
     """Represents the controller for Main"""
 
-    def __init__(self, app):
+    def __init__(self, app, on_ready=None, server=None):
         self.app = app
         self.main_window = MainWindow()
         self.main_window.save_button.Bind(wx.EVT_BUTTON, self.on_save)
         self.main_window.eval_button.Bind(wx.EVT_BUTTON, self.on_edit)
-        self.already_saved = False
-        self.imgfile = 'simple.png'
-        self.filename = 'simple.diag'
-        self.dirname = '.'
-        self.main_window.SetTitle('Editing {0}'.format(self.filename))
+        self.main_window.notebook.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED,
+                                       self.on_page_changed)
+        self.main_window.Bind(wx.EVT_CLOSE, self.on_close)
+        self.main_window.Bind(wx.EVT_IDLE, self.on_idle)
+        self.client = RenderClient(server) if server else None
+        ## interactive renders go ahead of exports and file renders
+        self.worker = RenderScheduler()
+        self.worker.start()
+        self.journal_writer = JournalWriter()
+        self.journal_writer.start()
+        self.budget = MemoryBudget()
+        self.debounce_timer = None
+        ## pages edited since their journal last recorded them
+        self.unjournaled = set()
+        self.journal_timer = None
+        ## started the first time a file or directory is watched
+        self.watcher = None
+        ## files being read into their pages, by page
+        self.loaders = {}
         self.main_window.SetMenuBar(self.build_menubar())
         self.main_window.status_bar = self.main_window.CreateStatusBar()
+        self.open_document(Document(), START_DIAG)
         self.main_window.Show()
+        self.render(on_ready)
+        self.restore_sessions()
+
+    @property
+    def document(self):
+        """The document in front"""
+        return self.main_window.page.document
+
+    def open_document(self, document, text):
+        """Opens a tab for a document and brings it to the front"""
+        page = self.main_window.add_page(document, text)
+        page.control.Bind(wx.EVT_TEXT, self.on_text)
+        self.budget.touch(document)
+        self.update_title()
+        self.start_journal(document, text)
+        return page
+
+    def start_journal(self, document, text):
+        """Starts recording the edits of a document to a journal, from the
+        text it holds now, dropping any earlier journal"""
+        if document.journal is not None:
+            document.journal.discard()
+        document.saved_text = text
+        document.journal = self.journal_writer.journal(
+            text, source=document.source, encoding=document.encoding,
+            filename=document.filename, dirname=document.dirname)
+
+    def record_journals(self):
+        """Records the text of every page edited since it was last recorded
+        in its journal"""
+        for page in self.unjournaled:
+            if page in self.main_window.pages():
+                page.document.journal.record(page.control.GetValue())
+        self.unjournaled.clear()
+
+    def restore_sessions(self):
+        """Offers to reopen the documents whose edits a previous session left
+        in its journals, and otherwise deletes those journals"""
+        sessions = recover(self.journal_writer.directory)
+        if not sessions:
+            return
+        answer = wx.MessageBox(
+            'Restore {0} unsaved diagram(s) from the last session?'.format(
+                len(sessions)), 'Recover', wx.YES_NO | wx.ICON_QUESTION)
+        for path, header, base, text in sessions:
+            if answer != wx.YES:
+                remove_journal(path)
+                continue
+            filename = header.get('filename') or 'recovered.diag'
+            document = Document(
+                filename=filename, dirname=header.get('dirname') or '.',
+                imgfile=os.path.splitext(filename)[0] + '.png')
+            document.source = header.get('source')
+            document.encoding = header.get('encoding') or 'utf-8'
+            self.open_document(document, text)
+            document.journal.discard()
+            document.saved_text = base or u''
+            document.journal = Journal.resume(self.journal_writer, path,
+                                              header, text)
+            self.render()
+
+    def update_title(self):
+        """Shows the name of the document in front in the title and tab"""
+        page = self.main_window.page
+        self.main_window.SetTitle('Editing {0}'.format(
+            page.document.filename))
+        self.main_window.notebook.SetPageText(
+            self.main_window.pages().index(page), page.document.filename)
+
+    def render(self, done=None, page=None, text=None):
+        """Renders a page, the one in front unless given, in the background,
+        and then keeps the images of every document under the memory budget.
+        A `text` is drawn for the page without touching its editor, e.g. the
+        first diagram of a file that is still being read into it."""
+        page = page or self.main_window.page
+
+        def rendered():
+            self.enforce_budget()
+            if done is not None:
+                done()
+        handlers.edit(self.main_window, self.worker, rendered,
+                      self.build_renderer(page.document), page, text)
+
+    def load_document(self, path):
+        """Opens a tab for a file and starts reading it into the editor,
+        a chunk at a time, whenever the application is idle"""
+        loader = DocumentLoader(path)
+        dirname, filename = os.path.split(path)
+        document = Document(filename=filename, dirname=dirname,
+                            imgfile=os.path.splitext(filename)[0] + '.png')
+        document.source = path
+        document.encoding = loader.encoding
+        document.bom = loader.bom
+        page = self.open_document(document, '')
+        self.loaders[page] = loader
+        wx.WakeUpIdle()
+
+    def build_renderer(self, document):
+        """Returns the function the render worker renders a document with:
+        its render state, or the render server if the application uses one.
+        The server neither folds repeated messages nor skips broken
+        statements, so documents that do are always rendered locally."""
+        state = document.render_state
+        if self.client is None or state.collapse or state.recover:
+            return state.render
+
+        def render(text, preview=None):
+            ## the server does not tell where errors are
+            state.errors = []
+            try:
+                return self.client.render(text), None
+            except RenderServerError as error:
+                ## reported as such, not as a syntax error
+                state.errors = [error]
+                return None, None
+        return render
+
+    def enforce_budget(self):
+        """Releases the images of background documents over the budget"""
+        for page in self.main_window.pages():
+            page.document.view_bytes = page.img.tile_bytes()
+        released = self.budget.enforce()
+        for page in self.main_window.pages():
+            if page.document in released:
+                page.img.clear()
 
     def build_menubar(self):
         """builds a menu bar for the main window"""
@@ -54,23 +215,79 @@ class MainController(object):
         menu_list = [
             (wx.ID_ABOUT, '&About', 'About this program', self.on_about),
             (wx.ID_OPEN, '&Open', 'Open a new file', self.on_open),
+            (wx.ID_ANY, 'Import &Trace...', 'Split a trace into diagrams',
+                self.on_import_trace),
+            (wx.ID_ANY, '&Watch Source', 'Follow changes made to the source '
+                'by other programs', self.on_watch_source),
+            (wx.ID_ANY, 'Watch &Directory...', 'Render the diagrams of a '
+                'directory whenever they change', self.on_watch_directory),
+            (wx.ID_ANY, 'Stop W&atching', 'Stop following changes to files',
+                self.on_stop_watching),
             (wx.ID_SAVE, '&Save', 'Save the current file', self.on_save),
             (wx.ID_SAVEAS, 'Save &As', 'Save under a different name',
                 self.on_save_as),
+            (wx.ID_ANY, 'Save Sou&rce\tCtrl+S', 'Save the diagram text',
+                self.on_save_source),
             (None, None, None, None),
             (wx.ID_EXIT, 'E&xit', 'Terminate the program', self.on_exit)]
+        menu_list[1:1] = [
+            (wx.ID_NEW, '&New', 'Edit a new diagram', self.on_new),
+            (wx.ID_CLOSE, '&Close', 'Close the current diagram',
+                self.on_close_document)]
         for item_id, label, help_text, handler in menu_list:
             if item_id is None:
                 file_menu.AppendSeparator()
             else:
                 item = file_menu.Append(item_id, label, help_text)
                 self.main_window.Bind(wx.EVT_MENU, handler, item)
+        view_menu = wx.Menu()
+        for label, help_text, handler in [
+                ('Zoom &In\tCtrl++', 'Enlarge the diagram', self.on_zoom_in),
+                ('Zoom &Out\tCtrl+-', 'Shrink the diagram', self.on_zoom_out),
+                ('&Actual Size\tCtrl+0', 'Show the diagram at its size',
+                    self.on_zoom_reset),
+                (None, None, None),
+                ('&Collapse Repeats\tCtrl+R', 'Fold repeated messages into '
+                    'one', self.on_collapse),
+                ('Skip &Broken Statements\tCtrl+B', 'Draw the rest of the '
+                    'diagram when some statements are invalid',
+                    self.on_recover),
+                ('Show C&hanges Since Saved\tCtrl+D', 'Compare the diagram '
+                    'with its saved version', self.on_show_changes),
+                (None, None, None),
+                ('Ne&xt Trace Window\tCtrl+]', 'Show the next window of '
+                    'the trace', self.on_next_window),
+                ('Pre&vious Trace Window\tCtrl+[', 'Show the previous '
+                    'window of the trace', self.on_previous_window),
+                ('&Go to Trace Window...\tCtrl+G', 'Show a window of the '
+                    'trace by number', self.on_go_to_window)]:
+            if label is None:
+                view_menu.AppendSeparator()
+                continue
+            if handler == self.on_collapse:
+                item = view_menu.AppendCheckItem(wx.ID_ANY, label, help_text)
+                self.collapse_item = item
+            elif handler == self.on_recover:
+                item = view_menu.AppendCheckItem(wx.ID_ANY, label, help_text)
+                self.recover_item = item
+            else:
+                item = view_menu.Append(wx.ID_ANY, label, help_text)
+            self.main_window.Bind(wx.EVT_MENU, handler, item)
+        tools_menu = wx.Menu()
+        item = tools_menu.Append(wx.ID_ANY, 'Export Render &Timings...',
+                                 'Save render timing histograms as JSON')
+        self.main_window.Bind(wx.EVT_MENU, self.on_export_timings, item)
+        item = tools_menu.AppendCheckItem(wx.ID_ANY, '&Capture Profile',
+                                          'Profile renders with cProfile')
+        self.main_window.Bind(wx.EVT_MENU, self.on_capture_profile, item)
         help_menu = wx.Menu()
         help_item = help_menu.Append(wx.ID_HELP, '&Documentation',
                                      'Help on this application')
         self.main_window.Bind(wx.EVT_MENU, self.on_help, help_item)
         menu_bar = wx.MenuBar()
         menu_bar.Append(file_menu, '&File')
+        menu_bar.Append(view_menu, '&View')
+        menu_bar.Append(tools_menu, '&Tools')
         menu_bar.Append(help_menu, '&Help')
         return menu_bar
 
@@ -84,10 +301,265 @@ class MainController(object):
         event.Skip()
         self.main_window.Close()
 
+    def on_close(self, event):
+        """Stops the render workers before the main window goes away"""
+        event.Skip()
+        self.worker.stop()
+        ## unsaved edits stay in their journals, to be restored next time;
+        ## the journals of documents without any are deleted
+        self.record_journals()
+        for page in self.main_window.pages():
+            if not self.has_unsaved_edits(page):
+                page.document.journal.discard()
+        self.journal_writer.stop()
+        self.journal_writer.join()
+        if self.watcher is not None:
+            self.watcher.stop()
+
+    def on_idle(self, event):
+        """Appends the next chunk of every file being loaded to its editor.
+        The first complete diagram of a file is rendered as soon as it has
+        been read, and the whole text once the file is loaded. A file that
+        turns out not to be in the encoding of its start is closed again,
+        rather than opened with some of its text replaced."""
+        event.Skip()
+        for page, loader in self.loaders.items():
+            found = loader.first_diagram is not None
+            try:
+                chunk = loader.step()
+            except LoadError as error:
+                self.close_page(page)
+                wx.MessageBox('Could not open {0}: {1}'.format(error.path,
+                                                               error),
+                              'Open', wx.OK | wx.ICON_ERROR)
+                continue
+            if chunk is not None:
+                page.control.AppendText(chunk)
+            if loader.done:
+                del self.loaders[page]
+                page.control.SetInsertionPoint(0)
+                self.start_journal(page.document, page.control.GetValue())
+                self.main_window.status_bar.SetStatusText(
+                    'Loaded {0}'.format(page.document.filename))
+                self.render(page=page)
+                continue
+            if not found and loader.first_diagram is not None:
+                self.render(page=page, text=loader.first_diagram)
+            self.main_window.status_bar.SetStatusText(
+                'Loading {0}: {1:.0%}'.format(page.document.filename,
+                                              loader.progress))
+        if self.loaders:
+            event.RequestMore()
+
     def on_edit(self, event):
         """Evaluates the entered text at each edition"""
         event.Skip()
-        handlers.edit(self.main_window)
+        self.render()
+
+    def on_new(self, event):
+        """Opens a tab for a new, empty diagram"""
+        event.Skip()
+        count = len(self.main_window.pages()) + 1
+        self.open_document(Document(filename='untitled{0}.diag'.format(
+            count), imgfile='untitled{0}.png'.format(count)), NEW_DIAG)
+        self.render()
+
+    def has_unsaved_edits(self, page):
+        """Returns whether the text of a page changed since it was opened or
+        last saved to its source. Pages still loading have no edits."""
+        return page not in self.loaders and \
+            page.control.GetValue() != page.document.saved_text
+
+    def on_close_document(self, event):
+        """Closes the tab in front, unless it is the last one. Unsaved edits
+        are only discarded once the user agrees."""
+        event.Skip()
+        page = self.main_window.page
+        if len(self.main_window.pages()) > 1:
+            if self.has_unsaved_edits(page) and wx.MessageBox(
+                    'Discard the unsaved changes to {0}?'.format(
+                        page.document.filename),
+                    'Close', wx.YES_NO | wx.ICON_QUESTION) != wx.YES:
+                return
+            self.close_page(page)
+
+    def close_page(self, page):
+        """Closes the tab of a document, dropping its journal and anything
+        still loading into it"""
+        if page in self.loaders:
+            self.loaders.pop(page).close()
+        self.unjournaled.discard(page)
+        page.document.journal.discard()
+        if self.watcher is not None and page.document.source:
+            self.watcher.remove(page.document.source)
+        self.budget.remove(page.document)
+        self.main_window.remove_page(page)
+
+    def on_page_changed(self, event):
+        """Brings a document to the front, rendering it again if its images
+        were released while it was in the background"""
+        event.Skip()
+        page = self.main_window.page
+        if page is None:
+            return
+        self.budget.touch(page.document)
+        self.update_title()
+        self.collapse_item.Check(page.document.render_state.collapse)
+        self.recover_item.Check(page.document.render_state.recover)
+        if page.raster is None and page not in self.loaders:
+            self.render()
+
+    def on_text(self, event):
+        """Schedules recording the edit in the journal, and a live preview
+        once the user pauses typing"""
+        event.Skip()
+        page = event.GetEventObject().GetParent()
+        if page in self.loaders:
+            return
+        self.unjournaled.add(page)
+        if self.journal_timer is None or not self.journal_timer.IsRunning():
+            self.journal_timer = wx.CallLater(JOURNAL_MS,
+                                              self.record_journals)
+        if not self.main_window.live_preview.GetValue():
+            return
+        if self.debounce_timer is not None and \
+                self.debounce_timer.IsRunning():
+            self.debounce_timer.Restart(DEBOUNCE_MS)
+        else:
+            self.debounce_timer = wx.CallLater(DEBOUNCE_MS, self.render)
+
+    def on_zoom_in(self, event):
+        """Shows the diagram at the next larger zoom level"""
+        event.Skip()
+        self.main_window.img.zoom_in()
+
+    def on_zoom_out(self, event):
+        """Shows the diagram at the next smaller zoom level"""
+        event.Skip()
+        self.main_window.img.zoom_out()
+
+    def on_zoom_reset(self, event):
+        """Shows the diagram at its actual size"""
+        event.Skip()
+        self.main_window.img.set_zoom(1.0)
+
+    def on_collapse(self, event):
+        """Folds the repeated runs of messages of the document in front, or
+        expands them again"""
+        event.Skip()
+        self.document.render_state.collapse = event.IsChecked()
+        self.render()
+
+    def on_recover(self, event):
+        """Makes the document in front leave its broken statements out of the
+        diagram, or fail on them again"""
+        event.Skip()
+        self.document.render_state.recover = event.IsChecked()
+        self.render()
+
+    def on_show_changes(self, event):
+        """Shows what changed in the diagram in front since its text was last
+        saved, until it is edited again"""
+        event.Skip()
+        page = self.main_window.page
+        if page is None or page in self.loaders:
+            return
+        base = page.document.saved_text
+        if not base:
+            self.main_window.status_bar.SetStatusText(
+                'There is no saved version to compare with')
+            return
+
+        def rendered(generation, result):
+            wx.CallAfter(self.show_changes, page, generation, result)
+        self.worker.submit(page.control.GetValue(), rendered,
+                           lambda text: diff_raster(base, text))
+
+    def show_changes(self, page, generation, result):
+        """Shows a rendered comparison in place of the diagram of a page"""
+        if not self.worker.is_current(generation):
+            return
+        if result is None:
+            self.main_window.status_bar.SetStatusText(
+                'Both versions must be valid diagrams to compare them')
+            return
+        raster, counts = result
+        page.img.SetBackgroundColour(wx.NullColour)
+        page.img.set_raster(raster)
+        ## the next render draws the document itself from scratch
+        page.raster = None
+        self.main_window.status_bar.SetStatusText(
+            'Changes since saved: ' + describe_diff(counts))
+
+    def show_trace_window(self, number):
+        """Replaces the text of the document in front, if it shows an
+        imported trace, with another window of the trace"""
+        document = self.document
+        if document.trace_index is None:
+            return
+        windows = document.trace_index['windows']
+        number = max(0, min(number, len(windows) - 1))
+        path = window_path(document.trace_dir, document.trace_index, number)
+        with io.open(path, 'r', encoding='utf-8') as source:
+            text = source.read()
+        document.dirname, document.filename = os.path.split(path)
+        document.imgfile = os.path.splitext(document.filename)[0] + '.png'
+        document.trace_window = number
+        document.already_saved = False
+        document.source = path
+        self.main_window.control.ChangeValue(text)
+        self.start_journal(document, text)
+        self.update_title()
+        self.main_window.status_bar.SetStatusText(
+            'Window {0} of {1}: {2} messages from trace line {3}'.format(
+                number + 1, len(windows), windows[number]['messages'],
+                windows[number]['first_line']))
+        self.render()
+
+    def on_next_window(self, event):
+        """Shows the next window of an imported trace"""
+        event.Skip()
+        if self.document.trace_index is not None:
+            self.show_trace_window(self.document.trace_window + 1)
+
+    def on_previous_window(self, event):
+        """Shows the previous window of an imported trace"""
+        event.Skip()
+        if self.document.trace_index is not None:
+            self.show_trace_window(self.document.trace_window - 1)
+
+    def on_go_to_window(self, event):
+        """Asks for the number of a window of an imported trace and shows
+        it"""
+        event.Skip()
+        document = self.document
+        if document.trace_index is None:
+            return
+        count = len(document.trace_index['windows'])
+        number = wx.GetNumberFromUser(
+            'Window of the trace', 'Window', 'Go to Trace Window',
+            document.trace_window + 1, 1, count, self.main_window)
+        if number > 0:
+            self.show_trace_window(number - 1)
+
+    def on_export_timings(self, event):
+        """Saves the render timings of this session to a JSON file"""
+        event.Skip()
+        path = self.ask_user_for_path(
+            defaultFile='render-timings.json', wildcard='*.json',
+            style=wx.SAVE)
+        if path:
+            INSTRUMENTS.dump(path)
+
+    def on_capture_profile(self, event):
+        """Starts a cProfile capture of renders, or stops it and saves it"""
+        event.Skip()
+        if event.IsChecked():
+            INSTRUMENTS.start_profile()
+            self.main_window.status_bar.SetStatusText('Capturing profile')
+        else:
+            INSTRUMENTS.stop_profile(self.ask_user_for_path(
+                defaultFile='render.prof', wildcard='*.prof', style=wx.SAVE))
 
     def on_help(self, event):
         """Show a documentation window where HTML help is displayed"""
@@ -98,30 +570,226 @@ class MainController(object):
 
     def on_save_as(self, event):
         """Saves the output graph to a file, whose filename must be provided by
-        the user"""
+        the user. The file extension selects the format; PNG images ask for
+        their resolution."""
+        options = self.default_file_dialog_options()
+        options['wildcard'] = EXPORT_WILDCARD
         if self.ask_user_for_filename(
-                defaultFile=self.imgfile, style=wx.SAVE,
-                **self.default_file_dialog_options()):
-            self.already_saved = True
+                defaultFile=self.document.imgfile, style=wx.SAVE, **options):
+            try:
+                image_format = export_format(self.document.filename)
+            except ValueError as error:
+                wx.MessageBox(str(error), 'Save As', wx.OK | wx.ICON_ERROR)
+                return
+            if image_format == 'PNG':
+                dpi = wx.GetNumberFromUser(
+                    'Resolution of the PNG image', 'DPI', 'Save As',
+                    self.document.dpi, 36, 1200, self.main_window)
+                if dpi < 0:
+                    return
+                self.document.dpi = dpi
+            self.document.already_saved = True
             self.on_save(event)
 
     def on_save(self, event):
-        """Saves the output graph to a file"""
+        """Saves the output graph to a file. The diagram is exported in the
+        background, behind interactive renders, while a progress dialog is
+        shown."""
         event.Skip()
-        if not self.already_saved:
+        document = self.document
+        if not document.already_saved:
             self.on_save_as(event)
+            return
+        path = os.path.join(document.dirname, document.filename)
+        dialog = wx.ProgressDialog(
+            'Exporting', 'Exporting {0}'.format(document.filename), 100,
+            self.main_window, wx.PD_APP_MODAL | wx.PD_AUTO_HIDE)
+
+        def progress(stage, fraction):
+            wx.CallAfter(dialog.Update, int(fraction * 99), stage)
+
+        def done(error):
+            wx.CallAfter(self.on_export_done, dialog, path, error)
+        self.worker.export(self.main_window.control.GetValue(), path,
+                           document.dpi, progress, done,
+                           document.render_state.collapse,
+                           document.render_state.recover)
+
+    def on_export_done(self, dialog, path, error):
+        """Closes the export progress dialog and reports how it went"""
+        dialog.Destroy()
+        if error is None:
+            self.main_window.status_bar.SetStatusText(
+                'Saved {0}'.format(path))
+        else:
+            wx.MessageBox('Could not save {0}: {1}'.format(path, error),
+                          'Save', wx.OK | wx.ICON_ERROR)
+
+    def on_save_source(self, event):
+        """Saves the text of the diagram to its source file, asking for one
+        if it has none. Only the text from the first change on is written."""
+        event.Skip()
+        document = self.document
+        path = document.source
+        if path is None:
+            path = self.ask_user_for_path(
+                defaultFile=os.path.splitext(document.filename)[0] + '.diag',
+                wildcard='*.diag', style=wx.SAVE)
+            if not path:
+                return
+        text = self.main_window.control.GetValue()
+        saved = document.saved_text if path == document.source else u''
+        try:
+            written = write_changes(path, saved, text, document.encoding,
+                                    document.bom)
+        except (IOError, OSError, UnicodeError) as error:
+            wx.MessageBox('Could not save {0}: {1}'.format(path, error),
+                          'Save Source', wx.OK | wx.ICON_ERROR)
+            return
+        document.source = path
+        document.saved_text = text
+        self.unjournaled.discard(self.main_window.page)
+        document.journal.rebase(text, source=path,
+                                encoding=document.encoding)
+        self.main_window.status_bar.SetStatusText(
+            'Saved {0} ({1} bytes written)'.format(path, written))
+
+    def watch(self, path):
+        """Starts following the changes to a file, or to the diagram sources
+        in a directory"""
+        if self.watcher is None:
+            self.watcher = Watcher(
+                lambda paths: wx.CallAfter(self.on_sources_changed, paths))
+            self.watcher.start()
+        self.watcher.add(path)
+        self.main_window.status_bar.SetStatusText(
+            'Watching {0}'.format(path))
+
+    def on_watch_source(self, event):
+        """Follows the changes made to the source of the document in front
+        by other programs"""
+        event.Skip()
+        if self.document.source is None:
+            wx.MessageBox('Save the diagram text first', 'Watch Source',
+                          wx.OK | wx.ICON_INFORMATION)
+            return
+        self.watch(self.document.source)
+
+    def on_watch_directory(self, event):
+        """Renders the diagram sources in a directory chosen by the user
+        whenever they change"""
+        event.Skip()
+        dialog = wx.DirDialog(self.main_window, 'Choose a directory to watch',
+                              self.document.dirname)
+        if dialog.ShowModal() == wx.ID_OK:
+            self.watch(dialog.GetPath())
+        dialog.Destroy()
+
+    def on_stop_watching(self, event):
+        """Stops following the changes to every file and directory"""
+        event.Skip()
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            self.main_window.status_bar.SetStatusText('Stopped watching')
+
+    def on_sources_changed(self, paths):
+        """Brings the changes made to watched sources into the documents
+        that show them. Changed sources in watched directories that are not
+        open are rendered into their image files in the background."""
+        if self.watcher is None:
+            return
+        jobs = []
+        for path in paths:
+            pages = [page for page in self.main_window.pages()
+                     if page.document.source == path]
+            for page in pages:
+                self.reload_source(page)
+            if not pages and os.path.isfile(path) and \
+                    os.path.dirname(path) in self.watcher.directories:
+                jobs.append((path, output_path(path, os.path.dirname(path))))
+        if jobs:
+            self.worker.render_files(
+                jobs, lambda source, elapsed, error: wx.CallAfter(
+                    self.on_source_rendered, source, elapsed, error))
+
+    def on_source_rendered(self, source, elapsed, error):
+        """Reports the background render of a watched source"""
+        if error is None:
+            message = 'Rendered {0} in {1:.2f}s'.format(source, elapsed)
         else:
-            self.main_window.img.GetBitmap().ConvertToImage().SaveFile(
-                os.path.join(self.dirname, self.filename), wx.BITMAP_TYPE_PNG)
+            message = 'Could not render {0}: {1}'.format(source, error)
+        self.main_window.status_bar.SetStatusText(message)
+
+    def reload_source(self, page):
+        """Updates a page with the text its source holds now, replacing only
+        the part of the editor that changed, and renders it again. Unsaved
+        edits are never overwritten."""
+        document = page.document
+        if page in self.loaders:
+            return
+        try:
+            with codecs.open(document.source, 'r', document.encoding) as f:
+                text = f.read()
+        except (IOError, UnicodeDecodeError):
+            return
+        if text.startswith(u'\ufeff'):
+            text = text[1:]
+        current = page.control.GetValue()
+        if text == current:
+            return
+        if current != document.saved_text:
+            self.main_window.status_bar.SetStatusText(
+                '{0} changed on disk; the unsaved edits are kept'.format(
+                    document.source))
+            return
+        start, end, inserted = text_delta(current, text)
+        page.control.Replace(start, end, inserted)
+        self.start_journal(document, text)
+        self.main_window.status_bar.SetStatusText(
+            'Reloaded {0}'.format(document.source))
+        self.render(page=page)
 
     def on_open(self, event):
-        """Opens a text file to edit"""
+        """Opens a text file to edit in a new tab. The file is loaded in the
+        background, see load_document."""
         event.Skip()
-        if self.ask_user_for_filename(
-                style=wx.OPEN, **self.default_file_dialog_options()):
-            textfile = open(os.path.join(self.dirname, self.filename), 'r')
-            self.main_window.control.SetValue(textfile.read())
-            textfile.close()
+        path = self.ask_user_for_path(style=wx.OPEN, wildcard='*.*')
+        if path:
+            self.load_document(path)
+
+    def on_import_trace(self, event):
+        """Splits a trace chosen by the user into windowed diagrams on a
+        background thread, and then opens its first window in a new tab"""
+        event.Skip()
+        path = self.ask_user_for_path(style=wx.OPEN, wildcard=TRACE_WILDCARD)
+        if not path:
+            return
+        output_dir = default_output_dir(path)
+
+        def progress(windows):
+            wx.CallAfter(self.main_window.status_bar.SetStatusText,
+                         'Importing {0}: {1} windows'.format(
+                             os.path.basename(path), windows))
+
+        def done(error, index):
+            wx.CallAfter(self.on_import_done, path, output_dir, error, index)
+        ImportWorker(path, output_dir, progress, done).start()
+
+    def on_import_done(self, path, output_dir, error, index):
+        """Opens the first window of an imported trace, or reports why the
+        import failed"""
+        if error is None and not index['windows']:
+            error = 'no messages found'
+        if error is not None:
+            wx.MessageBox('Could not import {0}: {1}'.format(path, error),
+                          'Import Trace', wx.OK | wx.ICON_ERROR)
+            return
+        document = Document(dirname=output_dir)
+        document.trace_dir = output_dir
+        document.trace_index = index
+        self.open_document(document, '')
+        self.show_trace_window(0)
 
     def ask_user_for_filename(self, **dialogOptions):
         """Returns the success of asking the user, through a wx standard
@@ -129,17 +797,31 @@ class MainController(object):
         dialog = wx.FileDialog(self.main_window, **dialogOptions)
         if dialog.ShowModal() == wx.ID_OK:
             filename_provided_by_user = True
-            self.filename = dialog.GetFilename()
-            self.dirname = dialog.GetDirectory()
-            self.main_window.SetTitle('Editing {0}'.format(self.filename))
+            self.document.filename = dialog.GetFilename()
+            self.document.dirname = dialog.GetDirectory()
+            self.update_title()
         else:
             filename_provided_by_user = False
         dialog.Destroy()
         return filename_provided_by_user
 
+    def ask_user_for_path(self, **dialogOptions):
+        """Returns a path chosen by the user through a wx standard dialog, or
+        None if the dialog was cancelled. Unlike ask_user_for_filename, the
+        file being edited does not change."""
+        dialog = wx.FileDialog(self.main_window, message='Choose a file',
+                               defaultDir=self.document.dirname,
+                               **dialogOptions)
+        if dialog.ShowModal() == wx.ID_OK:
+            path = dialog.GetPath()
+        else:
+            path = None
+        dialog.Destroy()
+        return path
+
     def default_file_dialog_options(self):
         """Returns a dictionary with file dialog options that can be
         used in both the save file dialog as well as in the open file
         dialog. """
-        return dict(message='Choose a file', defaultDir=self.dirname,
+        return dict(message='Choose a file', defaultDir=self.document.dirname,
                     wildcard='*.*')
@@ -0,0 +1,379 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    diffing.py
+Author:
+    Luis Osa <logc>
+Description:
+    Compares two versions of a diagram. The participants and statements of
+    both parsed trees are aligned with the Myers difference algorithm, over
+    small integer codes of the statements so that comparing two of them is
+    cheap, and merged into one diagram where added and removed messages and
+    participants are drawn in their own colours. This module does not depend
+    on wx.
+"""
+import argparse
+import difflib
+import os.path
+import sys
+import time
+
+import seqdiagrams
+from export import BASE_DPI, export_diagram
+from incremental import (IncrementalParser, ParseError, replace_fields,
+                         seqdiag_parser, with_statements)
+from instrumentation import timed
+
+## past this many edits, aligning with Myers gets slow and difflib is used
+MAX_EDITS = 500
+ADDED, REMOVED = 'added', 'removed'
+## the line and box colours of added and removed messages and participants
+EDGE_ATTRIBUTES = {ADDED: u'color = "#2e8b57"',
+                   REMOVED: u'color = "#cd4f39", style = dashed'}
+NODE_ATTRIBUTES = {ADDED: u'color = "#c1f0c1"', REMOVED: u'color = "#f4c2b8"'}
+_MARKERS = {}
+
+
+def _trim(a, b):
+    """Returns the lengths of the common prefix and suffix of two
+    sequences, which do not overlap"""
+    limit = min(len(a), len(b))
+    prefix = 0
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+
+def _myers(a, b, max_edits):
+    """Returns the edit path between two sequences as a list of ('equal',
+    i, j), ('delete', i, j) and ('insert', i, j) steps at positions of `a`
+    and `b`, or None if they differ in more than `max_edits` places"""
+    n, m = len(a), len(b)
+    offset = n + m + 1
+    v = [0] * (2 * offset + 1)
+    trace = []
+    for d in range(min(n + m, max_edits) + 1):
+        ## what the furthest reaching paths were before this round
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return None
+
+
+def _backtrack(trace, x, y):
+    """Follows the rounds of the Myers algorithm back from the end of both
+    sequences, and returns the steps of the path it found"""
+    steps = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        ## the snapshot of round d starts at diagonal -d - 1
+        if k == -d or (k != d and v[k - 1 + d + 1] < v[k + 1 + d + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = v[previous_k + d + 1]
+        previous_y = previous_x - previous_k
+        while x > previous_x and y > previous_y:
+            x -= 1
+            y -= 1
+            steps.append(('equal', x, y))
+        if d > 0:
+            if x == previous_x:
+                steps.append(('insert', x, previous_y))
+            else:
+                steps.append(('delete', previous_x, y))
+        x, y = previous_x, previous_y
+    steps.reverse()
+    return steps
+
+
+def opcodes(a, b, max_edits=MAX_EDITS):
+    """Returns how to turn sequence `a` into `b` as difflib opcodes, with
+    the tags 'equal', 'delete' and 'insert'. The items of both sequences
+    are compared often, so they should be cheap to compare, e.g. small
+    integers."""
+    prefix, suffix = _trim(a, b)
+    middle_a = a[prefix:len(a) - suffix]
+    middle_b = b[prefix:len(b) - suffix]
+    steps = _myers(middle_a, middle_b, max_edits)
+    codes = []
+    if steps is None:
+        matcher = difflib.SequenceMatcher(None, middle_a, middle_b,
+                                          autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'replace':
+                codes.append(('delete', i1, i2, j1, j1))
+                codes.append(('insert', i2, i2, j1, j2))
+            else:
+                codes.append((tag, i1, i2, j1, j2))
+    else:
+        for tag, i, j in steps:
+            if codes and codes[-1][0] == tag:
+                _, i1, _, j1, _ = codes.pop()
+            else:
+                i1, j1 = i, j
+            codes.append((tag, i1, i + (tag != 'insert'),
+                          j1, j + (tag != 'delete')))
+    codes = [(tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+             for tag, i1, i2, j1, j2 in codes]
+    if prefix:
+        codes.insert(0, ('equal', 0, prefix, 0, prefix))
+    if suffix:
+        codes.append(('equal', len(a) - suffix, len(a),
+                      len(b) - suffix, len(b)))
+    return codes
+
+
+def _kind(stmt):
+    """Returns the type name of a statement of a parsed tree"""
+    return type(stmt).__name__
+
+
+def _key(stmt):
+    """Returns what identifies a statement when aligning two trees. Groups
+    and other nested statements are aligned by their kind and name, and
+    their contents compared in turn."""
+    if getattr(stmt, 'stmts', None) is not None:
+        return _kind(stmt), getattr(stmt, 'id', None)
+    return repr(stmt)
+
+
+def _encode(stmts, codes):
+    """Returns the integer codes of the keys of some statements, adding new
+    keys to `codes`"""
+    return [codes.setdefault(_key(stmt), len(codes)) for stmt in stmts]
+
+
+def _marker(kind, change):
+    """Returns a parsed statement carrying the attributes of a change: an
+    'Edge' or a 'Node'"""
+    if (kind, change) not in _MARKERS:
+        if kind == 'Edge':
+            source = u'{{\nA -> B [{0}];\n}}'.format(EDGE_ATTRIBUTES[change])
+        else:
+            source = u'{{\nA [{0}];\n}}'.format(NODE_ATTRIBUTES[change])
+        _MARKERS[kind, change] = seqdiag_parser().parse_string(
+            source).stmts[0]
+    return _MARKERS[kind, change]
+
+
+def _mark(stmt, change):
+    """Returns a message drawn in the colours of a change"""
+    attrs = list(stmt.attrs or []) + list(_marker('Edge', change).attrs)
+    return replace_fields(stmt, attrs=attrs)
+
+
+def align_statements(old, new, counts):
+    """Returns the statements of both versions merged in order, with the
+    messages only found in one of them marked. Other statements that were
+    removed are left out. `counts` adds up the messages added and
+    removed."""
+    merged = []
+    codes = {}
+    for tag, i1, i2, j1, j2 in opcodes(_encode(old, codes),
+                                       _encode(new, codes)):
+        if tag == 'equal':
+            for old_stmt, new_stmt in zip(old[i1:i2], new[j1:j2]):
+                if getattr(new_stmt, 'stmts', None) is None:
+                    merged.append(new_stmt)
+                else:
+                    merged.append(with_statements(new_stmt, align_statements(
+                        old_stmt.stmts, new_stmt.stmts, counts)))
+        else:
+            change = REMOVED if tag == 'delete' else ADDED
+            for stmt in old[i1:i2] if tag == 'delete' else new[j1:j2]:
+                merged.extend(_changed(stmt, change, counts))
+    return merged
+
+
+def _changed(stmt, change, counts):
+    """Returns the statements that show a statement found in one version
+    only"""
+    if getattr(stmt, 'stmts', None) is not None:
+        stmts = [] if change == REMOVED else stmt.stmts
+        removed = stmt.stmts if change == REMOVED else []
+        return [with_statements(stmt, align_statements(removed, stmts,
+                                                       counts))]
+    if _kind(stmt) == 'Edge':
+        counts[change] += 1
+        return [_mark(stmt, change)]
+    if change == REMOVED:
+        return []
+    return [stmt]
+
+
+def _names(stmts):
+    """Yields the participant names some statements mention, in order"""
+    for stmt in stmts:
+        kind = _kind(stmt)
+        if kind == 'Node':
+            yield stmt.id
+        elif kind == 'Edge':
+            for name in _edge_names(stmt):
+                yield name
+        if getattr(stmt, 'stmts', None):
+            for name in _names(stmt.stmts):
+                yield name
+
+
+def _edge_names(edge):
+    """Returns the participant names of a message, in order. seqdiag 0.8
+    holds them in `nodes`, the first as a name and the others after their
+    arrow; later versions in `from_node`, `to_node` and `followers`."""
+    if hasattr(edge, 'nodes'):
+        names = edge.nodes
+    else:
+        names = [edge.from_node, edge.to_node] + list(edge.followers or [])
+    return [name[-1] if isinstance(name, tuple) else name for name in names]
+
+
+def participants(stmts):
+    """Returns the names of the participants of some statements, in the
+    order they first appear"""
+    found, seen = [], set()
+    for name in _names(stmts):
+        if isinstance(name, basestring) and name not in seen:
+            seen.add(name)
+            found.append(name)
+    return found
+
+
+def align_participants(old, new, counts):
+    """Returns node statements that declare the participants of both
+    versions in a merged order, marking those found in one of them only.
+    Participants that only moved keep the place they have in `new`."""
+    declared = []
+    kept = set(old) & set(new)
+    codes = {}
+    for tag, i1, i2, j1, j2 in opcodes(_encode_names(old, codes),
+                                       _encode_names(new, codes)):
+        if tag == 'delete':
+            names = [name for name in old[i1:i2] if name not in kept]
+            change = REMOVED
+        else:
+            names, change = new[j1:j2], ADDED
+        for name in names:
+            if name in kept:
+                declared.append(replace_fields(_marker('Node', ADDED),
+                                               id=name, attrs=[]))
+            else:
+                counts['participants ' + change] += 1
+                declared.append(replace_fields(_marker('Node', change),
+                                               id=name))
+    return declared
+
+
+def _encode_names(names, codes):
+    """Returns the integer codes of participant names"""
+    return [codes.setdefault(name, len(codes)) for name in names]
+
+
+@timed('diff')
+def diff_trees(old, new):
+    """Returns a parsed diagram tree that shows how the tree `old` turned
+    into `new`, and the number of messages and participants added and
+    removed"""
+    counts = dict.fromkeys((ADDED, REMOVED, 'participants ' + ADDED,
+                            'participants ' + REMOVED), 0)
+    stmts = align_participants(participants(old.stmts),
+                               participants(new.stmts), counts)
+    stmts.extend(align_statements(old.stmts, new.stmts, counts))
+    return with_statements(new, stmts), counts
+
+
+@seqdiagrams.serialized
+def diff_texts(old_text, new_text):
+    """Returns the abstract diagram, ready to draw like the one of
+    text2diagram, of the changes from one diagram source to another, and
+    the counts of diff_trees. Raises ParseError if either text is not a
+    valid diagram."""
+    seqdiagrams.load()
+    ## a parser of its own, not to evict the statements of the diagram being
+    ## edited from the cache of seqdiagrams.PARSER
+    parser = IncrementalParser()
+    old = parser.parse(old_text)
+    new = parser.parse(new_text)
+    tree, counts = diff_trees(old, new)
+    return seqdiagrams.ScreenNodeBuilder.build(tree), counts
+
+
+@seqdiagrams.serialized
+def diff_raster(old_text, new_text):
+    """Returns the raster of the diagram of diff_texts, and its counts"""
+    diagram, counts = diff_texts(old_text, new_text)
+    return seqdiagrams.diagram2raster(diagram), counts
+
+
+def describe(counts):
+    """Returns a one line summary of the counts of a diff"""
+    return ('{0} messages added, {1} removed; {2} participants added, '
+            '{3} removed').format(counts[ADDED], counts[REMOVED],
+                                  counts['participants ' + ADDED],
+                                  counts['participants ' + REMOVED])
+
+
+def build_parser():
+    """Builds the command line parser of the diagram differ"""
+    parser = argparse.ArgumentParser(
+        prog='seqdiag_gui-diff',
+        description='Draw the changes between two versions of a diagram.')
+    parser.add_argument('old', help='the earlier diagram source')
+    parser.add_argument('new', help='the later diagram source')
+    parser.add_argument('-o', '--output', default=None,
+                        help='image to write; the later source with a '
+                        '.diff.png extension by default')
+    parser.add_argument('--dpi', type=int, default=BASE_DPI)
+    return parser
+
+
+def run(argv=None):
+    """Diagram differ entry point"""
+    options = build_parser().parse_args(argv)
+    output = options.output or \
+        os.path.splitext(options.new)[0] + '.diff.png'
+    texts = []
+    for path in (options.old, options.new):
+        with open(path, 'rb') as source:
+            texts.append(source.read().decode('utf-8-sig'))
+    start = time.time()
+    try:
+        diagram, counts = diff_texts(*texts)
+    except ParseError as error:
+        print >> sys.stderr, 'Invalid diagram: {0}'.format(error)
+        return 1
+    elapsed = time.time() - start
+    export_diagram(diagram, output, options.dpi)
+    print '{0} in {1:.3f}s; written to {2}'.format(describe(counts),
+                                                   elapsed, output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
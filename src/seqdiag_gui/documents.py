@@ -0,0 +1,106 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    documents.py
+Author:
+    Luis Osa <logc>
+Description:
+    The Models of open documents. Every document keeps its own render state;
+    a memory budget decides which background documents give up their images
+    until they are shown again. This module does not depend on wx.
+"""
+from export import BASE_DPI
+from seqdiagrams import RenderState
+
+MEMORY_BUDGET = 128 * 1024 * 1024
+
+
+class Document(object):
+    """An open diagram: the files it is read from and saved to, and the state
+    of its last render"""
+
+    def __init__(self, filename='simple.diag', dirname='.',
+                 imgfile='simple.png'):
+        self.filename = filename
+        self.dirname = dirname
+        self.imgfile = imgfile
+        self.already_saved = False
+        self.dpi = BASE_DPI
+        ## the file the text is read from and saved to, if any, its encoding
+        ## and the text it held when last read or written
+        self.source = None
+        self.encoding = 'utf-8'
+        self.bom = ''
+        self.saved_text = u''
+        self.journal = None
+        ## the imported trace this document shows a window of, if any
+        self.trace_dir = None
+        self.trace_index = None
+        self.trace_window = None
+        self.render_state = RenderState()
+        ## extra bytes held for this document outside the render state, such
+        ## as the tiles of the canvas that shows it
+        self.view_bytes = 0
+
+    @property
+    def nbytes(self):
+        """Returns the memory taken by the images of this document"""
+        raster = self.render_state.raster
+        return (len(raster.data) if raster is not None else 0) + \
+            self.view_bytes
+
+    def release(self):
+        """Drops the images of this document, keeping its parsed diagram and
+        layout, and returns how many bytes were released"""
+        released = self.nbytes
+        self.render_state.raster = None
+        self.view_bytes = 0
+        return released
+
+
+class MemoryBudget(object):
+    """Tracks open documents from the least to the most recently shown, and
+    releases the images of background documents while they take more than
+    `max_bytes` together"""
+
+    def __init__(self, max_bytes=MEMORY_BUDGET):
+        self.max_bytes = max_bytes
+        self.documents = []
+
+    def touch(self, document):
+        """Marks a document as the one being shown"""
+        if document in self.documents:
+            self.documents.remove(document)
+        self.documents.append(document)
+
+    def remove(self, document):
+        """Stops tracking a closed document"""
+        if document in self.documents:
+            self.documents.remove(document)
+
+    def enforce(self):
+        """Releases background documents, least recently shown first, until
+        the budget is met. Returns the released documents. The document shown
+        last is never released."""
+        total = sum(document.nbytes for document in self.documents)
+        released = []
+        for document in self.documents[:-1]:
+            if total <= self.max_bytes:
+                break
+            if document.nbytes:
+                total -= document.release()
+                released.append(document)
+        return released
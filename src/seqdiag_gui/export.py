@@ -0,0 +1,106 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    export.py
+Author:
+    Luis Osa <logc>
+Description:
+    Exports diagrams to files. The format follows the file extension; vector
+    formats are written by the seqdiag drawer straight into the file, without
+    rasterising the diagram. This module does not depend on wx.
+"""
+import math
+import os.path
+
+import seqdiagrams
+
+EXPORT_FORMATS = {'.png': 'PNG', '.svg': 'SVG', '.pdf': 'PDF'}
+EXPORT_WILDCARD = ('PNG image (*.png)|*.png|'
+                   'SVG image (*.svg)|*.svg|'
+                   'PDF document (*.pdf)|*.pdf')
+## seqdiag lays diagrams out in pixels at this resolution
+BASE_DPI = 72
+
+
+def export_format(path):
+    """Returns the seqdiag format name for the extension of `path`. Raises
+    ValueError for extensions that cannot be exported."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXPORT_FORMATS:
+        raise ValueError('Cannot export to {0} files; use one of {1}'.format(
+            extension or 'extensionless',
+            ', '.join(sorted(EXPORT_FORMATS))))
+    return EXPORT_FORMATS[extension]
+
+
+def export(text, path, dpi=BASE_DPI, progress=None, collapse=False,
+           recover=False):
+    """Renders a text into the file at `path`, in the format given by its
+    extension. PNG images are drawn at `dpi`. `progress`, if given, is
+    called with a stage name and the completed fraction of the export. With
+    `collapse`, repeated runs of messages are folded into one; with
+    `recover`, broken statements are left out."""
+    report = progress or (lambda stage, fraction: None)
+    export_format(path)
+    ## reported without holding SEQDIAG_LOCK, as the scheduler pauses
+    ## exports from the progress callback until interactive renders are done
+    report('Drawing', 0.0)
+    _export(text, path, dpi, collapse, recover)
+    report('Done', 1.0)
+
+
+@seqdiagrams.serialized
+def _export(text, path, dpi, collapse, recover):
+    """Builds and draws a text for export()"""
+    diagram = seqdiagrams.text2diagram(text, collapse, recover=recover)
+    if diagram is None:
+        raise ValueError('Text does not evaluate to a valid sequence diagram')
+    _draw(diagram, path, dpi)
+
+
+def export_diagram(diagram, path, dpi=BASE_DPI, progress=None):
+    """Draws an abstract diagram into the file at `path`, like export()"""
+    report = progress or (lambda stage, fraction: None)
+    export_format(path)
+    report('Drawing', 0.0)
+    _draw(diagram, path, dpi)
+    report('Done', 1.0)
+
+
+@seqdiagrams.serialized
+def _draw(diagram, path, dpi):
+    """Draws an abstract diagram into a file for export_diagram()"""
+    format = export_format(path)
+    if format == 'PNG' and dpi != BASE_DPI:
+        scale = dpi / float(BASE_DPI)
+        ## drawn at the next whole multiple of the layout, or twice that when
+        ## antialiased, and reduced to the resolution asked for
+        ratio = int(math.ceil(scale)) * (2 if seqdiagrams.ANTIALIAS else 1)
+        drawer = seqdiagrams.new_drawer(diagram, ratio)
+        drawer.draw()
+        image = seqdiagrams.painted_image(drawer.drawer)
+        width, height = drawer.pagesize()
+        size = (int(round(width * scale)), int(round(height * scale)))
+        if image.size != size:
+            image = image.resize(size, seqdiagrams.Image.ANTIALIAS)
+        image.save(path, format, dpi=(dpi, dpi))
+    else:
+        drawer = seqdiagrams.DiagramDraw(format, diagram, filename=path,
+                                         font=seqdiagrams.FONTPATH,
+                                         antialias=seqdiagrams.ANTIALIAS,
+                                         transparency=True)
+        drawer.draw()
+        drawer.save()
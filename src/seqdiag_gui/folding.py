@@ -0,0 +1,107 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    folding.py
+Author:
+    Luis Osa <logc>
+Description:
+    Folds repeated runs of messages in a parsed diagram tree, such as retry
+    loops or polling, into a single copy between two separators that tell how
+    many times it was repeated. The folded tree is laid out and drawn like any
+    other, only smaller. This module does not depend on wx.
+"""
+from incremental import seqdiag_parser, with_statements
+
+## the longest run of messages that is looked for as a repeated unit, and how
+## many times in a row it must appear to be folded
+MAX_PERIOD = 16
+MIN_REPEATS = 3
+## the multiplication sign, written before the repeat count
+TIMES = u'\u00d7'
+_SEPARATORS = {}
+
+
+def _is_message(stmt):
+    """Returns whether a statement of a parsed tree is a message"""
+    return type(stmt).__name__ == 'Edge'
+
+
+def separator(label):
+    """Returns the parsed statement of a separator with a label"""
+    if label not in _SEPARATORS:
+        tree = seqdiag_parser().parse_string(
+            u'{{\n=== {0} ===\n}}'.format(label))
+        _SEPARATORS[label] = tree.stmts[0]
+    return _SEPARATORS[label]
+
+
+def find_repeat(keys, start, max_period=MAX_PERIOD, min_repeats=MIN_REPEATS):
+    """Returns the period and repeat count of the run of repeated messages
+    that covers the most statements from `start`, preferring shorter periods,
+    or None if there is no such run. `keys` compares the statements; None
+    marks statements that are not messages."""
+    best = None
+    for period in range(1, max_period + 1):
+        unit = keys[start:start + period]
+        if len(unit) < period or None in unit:
+            break
+        repeats = 1
+        while keys[start + repeats * period:
+                   start + (repeats + 1) * period] == unit:
+            repeats += 1
+        if repeats >= min_repeats and \
+                (best is None or period * repeats > best[0] * best[1]):
+            best = (period, repeats)
+    return best
+
+
+def fold_statements(stmts, max_period=MAX_PERIOD, min_repeats=MIN_REPEATS):
+    """Returns a list of statements where every run of repeated messages is
+    replaced by one copy between separators, and the number of statements
+    that were folded away. Groups and other nested statements are folded
+    too."""
+    keys = [repr(stmt) if _is_message(stmt) else None for stmt in stmts]
+    folded, removed = [], 0
+    i = 0
+    while i < len(stmts):
+        repeat = find_repeat(keys, i, max_period, min_repeats)
+        if repeat is None:
+            stmt = stmts[i]
+            if getattr(stmt, 'stmts', None):
+                inner, count = fold_statements(stmt.stmts, max_period,
+                                               min_repeats)
+                if count:
+                    stmt = with_statements(stmt, inner)
+                    removed += count
+            folded.append(stmt)
+            i += 1
+            continue
+        period, repeats = repeat
+        folded.append(separator(TIMES + unicode(repeats)))
+        folded.extend(stmts[i:i + period])
+        folded.append(separator(u'end ' + TIMES + unicode(repeats)))
+        removed += period * (repeats - 1)
+        i += period * repeats
+    return folded, removed
+
+
+def fold(tree, max_period=MAX_PERIOD, min_repeats=MIN_REPEATS):
+    """Returns a parsed diagram tree with its repeated runs of messages
+    folded. The tree itself is returned when nothing repeats."""
+    stmts, removed = fold_statements(tree.stmts, max_period, min_repeats)
+    if not removed:
+        return tree
+    return with_statements(tree, stmts)
@@ -0,0 +1,201 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    fonts.py
+Author:
+    Luis Osa <logc>
+Description:
+    Process-wide caches of loaded fonts and of measured text sizes. Every
+    render of seqdiag loads its fonts again and measures every label, most of
+    them the same as in the previous render; these caches answer both from
+    memory, and the text sizes are kept on disk between sessions. This module
+    does not depend on wx.
+"""
+import atexit
+import cPickle
+import errno
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+MAX_FONTS = 32
+MAX_METRICS = 64 * 1024
+METRICS_DIR = os.path.join(os.path.expanduser('~'), '.seqdiag_gui')
+METRICS_FILE = 'text-metrics.pickle'
+## bump whenever the meaning of the stored measurements changes
+METRICS_VERSION = 1
+
+
+class LRUCache(object):
+    """A thread-safe mapping that forgets its least recently used entries
+    once it holds more than `max_entries`"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the entry for `key`, marking it as recently used"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            value = self._entries.pop(key)
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Stores an entry, evicting the least recently used ones if needed"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        """Returns the entries, from the least to the most recently used"""
+        with self._lock:
+            return self._entries.items()
+
+    def clear(self):
+        """Forgets every entry"""
+        with self._lock:
+            self._entries.clear()
+
+
+class TextMetrics(LRUCache):
+    """Measured text sizes keyed by font path, font size and text. When a
+    `directory` is given, the measurements are read from it on first use and
+    written back by save()."""
+
+    def __init__(self, max_entries=MAX_METRICS, directory=None):
+        super(TextMetrics, self).__init__(max_entries)
+        self.directory = directory
+        self.dirty = False
+        self._loaded = False
+
+    def get(self, key, default=None):
+        if not self._loaded:
+            self.load()
+        return super(TextMetrics, self).get(key, default)
+
+    def put(self, key, value):
+        super(TextMetrics, self).put(key, value)
+        self.dirty = True
+
+    def _path(self):
+        """Returns the file the measurements are kept in"""
+        return os.path.join(self.directory, METRICS_FILE)
+
+    def load(self):
+        """Reads the measurements of earlier sessions, if any"""
+        self._loaded = True
+        if self.directory is None:
+            return
+        try:
+            with open(self._path(), 'rb') as metricsfile:
+                version, entries = cPickle.load(metricsfile)
+        except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+            return
+        if version != METRICS_VERSION:
+            return
+        for key, value in entries[-self.max_entries:]:
+            super(TextMetrics, self).put(key, value)
+
+    def save(self):
+        """Writes the measurements to disk if they changed. The file is
+        written under a temporary name first, so readers never see half of
+        it."""
+        if self.directory is None or not self.dirty:
+            return
+        try:
+            os.makedirs(self.directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        handle, tmpname = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as metricsfile:
+            cPickle.dump((METRICS_VERSION, self.items()), metricsfile,
+                         cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, self._path())
+        self.dirty = False
+
+
+FONTS = LRUCache(MAX_FONTS)
+METRICS = TextMetrics(MAX_METRICS, METRICS_DIR)
+
+
+def font_key(font):
+    """Returns the cache key of a seqdiag font description"""
+    return getattr(font, 'path', None), getattr(font, 'size', None)
+
+
+def cached_font(load_font, fonts=FONTS):
+    """Wraps a function that loads the font for a font description so that
+    every font is only loaded once"""
+    def wrapper(font):
+        key = font_key(font)
+        ttfont = fonts.get(key)
+        if ttfont is None:
+            ttfont = load_font(font)
+            if ttfont is not None:
+                fonts.put(key, ttfont)
+        return ttfont
+    wrapper.__wrapped__ = load_font
+    return wrapper
+
+
+def cached_textsize(textsize, metrics=METRICS):
+    """Wraps the text measuring method of a seqdiag drawer so that every text
+    is only measured once per font and drawing scale"""
+    def wrapper(drawer, string, font):
+        key = font_key(font) + (getattr(drawer, 'scale_ratio', 1), string)
+        size = metrics.get(key)
+        if size is None:
+            size = textsize(drawer, string, font)
+            metrics.put(key, size)
+        return size
+    wrapper.__wrapped__ = textsize
+    return wrapper
+
+
+def install(fonts=FONTS, metrics=METRICS):
+    """Makes the PNG drawer of seqdiag load fonts and measure texts through
+    the caches, and saves the measurements when the process exits. Returns
+    whether the drawer could be found."""
+    try:
+        from blockdiag.imagedraw import png
+    except ImportError:
+        return False
+    if getattr(png, '_cached_metrics', None) is not None:
+        return True
+    if hasattr(png, 'ttfont_for'):
+        png.ttfont_for = cached_font(png.ttfont_for, fonts)
+    for value in vars(png).values():
+        if isinstance(value, type) and 'textsize' in vars(value):
+            value.textsize = cached_textsize(vars(value)['textsize'],
+                                             metrics)
+    png._cached_metrics = metrics
+    atexit.register(metrics.save)
+    return True
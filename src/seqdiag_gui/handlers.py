@@ -20,12 +20,19 @@ Author:
 Description:
     Handler functions for different application events
 """
-import cStringIO
+from wx import AboutDialogInfo, CallAfter, Colour, NullColour, TextAttr
+try:
+    from wx import BitmapFromBufferRGBA
+except ImportError:
+    from wx import Bitmap
+    BitmapFromBufferRGBA = Bitmap.FromBufferRGBA
 
-from wx import AboutDialogInfo, Colour, InputStream, ImageFromStream
-from wx import NullColour
+from incremental import ParseError
+from instrumentation import INSTRUMENTS, timed
+
+## the colour is named 'tomato3' on http://web.njit.edu/~kevin/rgb.txt.html
+ERROR_COLOUR = (205, 79, 57)
 
-from seqdiagrams import text2diagram, diagram2png
 
 LICENSE = """
 
@@ -60,20 +67,107 @@ def build_infobox():
     return info
 
 
-def edit(mainwindow):
-    """handles an edition in the text control by updating the diagram"""
-    diagram_tree = text2diagram(mainwindow.control.GetValue())
-    if diagram_tree:
-        mainwindow.status_bar.SetStatusText("")
-        mainwindow.img.SetBackgroundColour(NullColour)
-        img = diagram2png(diagram_tree)
-        stream = InputStream(cStringIO.StringIO(img))
-        png = ImageFromStream(stream)
-        mainwindow.img.SetBitmap(png.ConvertToBitmap())
+@timed('bitmap')
+def raster2bitmap(raster):
+    """builds a bitmap straight from the pixel buffer of a rendered diagram"""
+    return BitmapFromBufferRGBA(raster.width, raster.height, raster.data)
+
+
+def edit(mainwindow, worker, done=None, render=None, page=None, text=None):
+    """handles an edition in the text control of a page, the one in front
+    unless given, by rendering the diagram on the background worker, with
+    `render` if given. `text`, if given, is rendered instead of what the
+    control holds, which is left alone. The image is updated once the render
+    finishes, and then `done` is called if given"""
+    page = page or mainwindow.page
+    if text is None:
+        text = page.control.GetValue()
+
+    def rendered(generation, img):
+        CallAfter(show_render, mainwindow, page, worker, generation, img,
+                  done)
+
+    def previewed(generation, sketch):
+        CallAfter(show_preview, mainwindow, page, worker, generation, sketch)
+    worker.submit(text, rendered, render,
+                  previewed if render is not None else None)
+
+
+def show_preview(mainwindow, page, worker, generation, sketch):
+    """shows a quick sketch of a large diagram, stretched to its full size,
+    while the full render is still running"""
+    if not worker.is_current(generation):
+        return
+    raster, scale = sketch
+    page.img.SetBackgroundColour(NullColour)
+    page.img.set_raster(raster, scale=scale)
+    mainwindow.status_bar.SetStatusText('Preview; drawing the full diagram')
+
+
+def highlight_errors(page, errors):
+    """marks the lines of the text control of a page that hold syntax errors,
+    clearing the marks of the previous render"""
+    control = page.control
+    last = control.GetLastPosition()
+    plain = TextAttr(NullColour, control.GetBackgroundColour())
+    for start, end in page.error_ranges:
+        control.SetStyle(min(start, last), min(end, last), plain)
+    page.error_ranges = []
+    marked = TextAttr(NullColour, Colour(*ERROR_COLOUR))
+    for error in errors:
+        if getattr(error, 'line', None) is None:
+            continue
+        start = control.XYToPosition(0, error.line - 1)
+        if start < 0:
+            continue
+        end = start + max(1, control.GetLineLength(error.line - 1))
+        control.SetStyle(start, end, marked)
+        page.error_ranges.append((start, end))
+
+
+def describe_errors(errors):
+    """returns the status bar message about the errors of a render: syntax
+    errors, or the error that kept the diagram from being rendered at all"""
+    if not errors:
+        return "Text edition does not evaluate to a valid sequence diagram"
+    if not isinstance(errors[-1], ParseError):
+        return "Could not render: {0}".format(errors[-1])
+    return "Syntax error at {0}".format(errors[-1])
+
+
+def show_render(mainwindow, page, worker, generation, result, done=None):
+    """updates the diagram with a finished render, unless a newer edition has
+    been submitted in the meantime. The bitmap is left alone when the render
+    reports that nothing visible changed, and only the changed regions are
+    repainted when the layout stayed the same. When the text is not valid,
+    the last valid diagram stays on screen and the error is marked in the
+    text."""
+    if not worker.is_current(generation):
+        return
+    raster, boxes = result or (None, None)
+    errors = page.document.render_state.errors
+    if errors or page.error_ranges:
+        highlight_errors(page, errors)
+    if raster:
+        page.img.SetBackgroundColour(NullColour)
+        ## a preview on screen is replaced even if nothing changed since the
+        ## last full render
+        if boxes != [] or page.img.scale != 1.0:
+            page.raster = raster
+            page.img.set_raster(raster, boxes)
+            ## paint now, so the bitmap conversion is part of the breakdown
+            page.img.Update()
+        if errors:
+            mainwindow.status_bar.SetStatusText(
+                "Skipped {0} broken statement(s); {1}".format(
+                    len(errors), describe_errors(errors)))
+        else:
+            mainwindow.status_bar.SetStatusText(INSTRUMENTS.summary())
     else:
-        ## the colour is named 'tomato3' on
-        ## http://web.njit.edu/~kevin/rgb.txt.html
-        mainwindow.status_bar.SetStatusText(
-            "Text edition does not evaluate to a valid sequence diagram")
-        mainwindow.img.SetBackgroundColour(Colour(205, 79, 57))
-        mainwindow.img.Refresh()
+        mainwindow.status_bar.SetStatusText(describe_errors(errors))
+        ## with nothing rendered yet, there is no valid diagram to keep
+        if page.raster is None:
+            page.img.SetBackgroundColour(Colour(*ERROR_COLOUR))
+            page.img.Refresh()
+    if done is not None:
+        done()
@@ -0,0 +1,414 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    incremental.py
+Author:
+    Luis Osa <logc>
+Description:
+    An incremental front end to the seqdiag parser. The diagram body is split
+    into top-level statements, and only statements that changed since a
+    previous parse are sent through the seqdiag parser again. Syntax errors
+    are located in the statement that holds them, and a recovering parse can
+    leave broken statements out instead of failing.
+"""
+import copy
+import re
+import threading
+from collections import OrderedDict
+
+## the statements kept cached, at least; the cache grows to hold twice the
+## statements of the largest diagram parsed, so that an edited diagram and
+## the version before it always fit
+MAX_CACHED_STATEMENTS = 4096
+## below this fraction of cached statements, the whole diagram is parsed at
+## once, which is much faster than parsing every statement on its own
+MIN_CACHED_FRACTION = 0.5
+## the statements that seqdiag sorts ahead of the others
+ATTRIBUTE_STATEMENTS = ('Attr', 'DefAttrs', 'AttrClass', 'AttrPlugin',
+                        'Extension')
+## how seqdiag error messages locate errors: the parser tells the
+## "line,column-line,column" of a token, the tokenizer a line and column
+POSITIONS = (re.compile(r' (\d+),(\d+)-\d+,\d+:'),
+             re.compile(r' at line (\d+) column (\d+)'))
+
+
+def seqdiag_parser():
+    """Returns the seqdiag parser module, which is only imported on first
+    use to keep application startup fast"""
+    from seqdiag import parser
+    return parser
+
+
+def significant_chars(text):
+    """Yields the index and value of every character of a diagram source that
+    is neither blank nor inside a comment. A quoted string is yielded as its
+    opening quote alone."""
+    i, length = 0, len(text)
+    while i < length:
+        char = text[i]
+        if char.isspace():
+            i += 1
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = length if end < 0 else end + 2
+        elif char == '#' or text.startswith('//', i):
+            end = text.find('\n', i)
+            i = length if end < 0 else end + 1
+        else:
+            yield i, char
+            if char in '"\'':
+                i += 1
+                while i < length and text[i] != char:
+                    i += 2 if text[i] == '\\' else 1
+            i += 1
+
+
+class DiagramEndScanner(object):
+    """Finds the end of the first complete top-level block of a diagram
+    source that is fed to it in pieces, as significant_chars() would read
+    the whole source. Every piece is scanned once: the depth of the braces,
+    and whether a comment or a quoted string is still open, are kept
+    between pieces."""
+
+    def __init__(self):
+        ## the index just past the closing brace, once found
+        self.end = None
+        self._depth = 0
+        ## None, or the comment ('/*' or '//') or quote the scan is in
+        self._state = None
+        ## the end of the last piece, which must be read again with the
+        ## next one, and its index in the source
+        self._carry = u''
+        self._offset = 0
+
+    def feed(self, piece):
+        """Scans the next piece of the source. Returns the index just past
+        the closing brace of the first block, or None if not found yet."""
+        if self.end is not None:
+            return self.end
+        text = self._carry + piece
+        offset = self._offset - len(self._carry)
+        self._offset += len(piece)
+        self._carry = u''
+        i, length = 0, len(text)
+        while i < length:
+            state = self._state
+            if state == '/*':
+                end = text.find('*/', i)
+                if end < 0:
+                    if text.endswith('*') and length - 1 >= i:
+                        self._carry = u'*'
+                    return None
+                i, self._state = end + 2, None
+            elif state == '//':
+                end = text.find('\n', i)
+                if end < 0:
+                    return None
+                i, self._state = end + 1, None
+            elif state is not None:
+                while i < length and text[i] != state:
+                    i += 2 if text[i] == '\\' else 1
+                if i >= length:
+                    ## an escape at the end escapes the next piece
+                    self._carry = text[-1:] if i > length else u''
+                    return None
+                i, self._state = i + 1, None
+            else:
+                char = text[i]
+                if char.isspace():
+                    i += 1
+                elif char == '/' and i + 1 == length:
+                    ## may start a comment with the next piece
+                    self._carry = char
+                    return None
+                elif text.startswith('/*', i):
+                    i, self._state = i + 2, '/*'
+                elif char == '#' or text.startswith('//', i):
+                    i, self._state = i + 1, '//'
+                elif char in '"\'':
+                    i, self._state = i + 1, char
+                else:
+                    if char == '{':
+                        self._depth += 1
+                    elif char == '}':
+                        self._depth -= 1
+                        if self._depth == 0:
+                            self.end = offset + i + 1
+                            return self.end
+                    i += 1
+        return None
+
+
+def diagram_end(text):
+    """Returns the index just past the closing brace of the first complete
+    top-level block of a diagram source, or None if there is none yet"""
+    return DiagramEndScanner().feed(text)
+
+
+def error_position(error):
+    """Returns the line and column, both counted from 1, that a seqdiag parse
+    error points at, or None if its message does not tell"""
+    for pattern in POSITIONS:
+        match = pattern.search(str(error))
+        if match is not None:
+            return int(match.group(1)), max(1, int(match.group(2)))
+    return None
+
+
+def error_message(error):
+    """Returns the message of a seqdiag parse error without the position it
+    gives, which is relative to the source that was parsed"""
+    message = str(error)
+    for pattern in POSITIONS:
+        message = pattern.sub('', message)
+    return message
+
+
+def position_offset(text, line, column):
+    """Returns the index in a text of a line and column counted from 1"""
+    offset = 0
+    for _ in range(line - 1):
+        offset = text.find('\n', offset)
+        if offset < 0:
+            return len(text)
+        offset += 1
+    end = text.find('\n', offset)
+    end = len(text) if end < 0 else end
+    return min(offset + column - 1, end)
+
+
+class ParseError(Exception):
+    """A syntax error in a diagram source, at a character `offset` of it, or
+    at no known place if the offset is None. `line` and `column` count from
+    1."""
+
+    def __init__(self, message, text=u'', offset=None):
+        super(ParseError, self).__init__(message)
+        self.message = message
+        self.offset = offset
+        self.line = self.column = None
+        if offset is not None:
+            line_start = text.rfind('\n', 0, offset) + 1
+            self.line = text.count('\n', 0, offset) + 1
+            self.column = offset - line_start + 1
+
+    def __str__(self):
+        if self.line is None:
+            return self.message
+        return 'line {0}, column {1}: {2}'.format(self.line, self.column,
+                                                 self.message)
+
+
+def located_error(error, text, start=0, source=None, skipped=0):
+    """Returns the ParseError of a seqdiag parse error raised by parsing
+    `source`, which is `text` from index `start` on unless given. The first
+    `skipped` characters of the source are not part of the text; errors in
+    them are located at `start`."""
+    if source is None:
+        source = text[start:]
+    position = error_position(error)
+    offset = start
+    if position is not None:
+        offset += max(0, position_offset(source, *position) - skipped)
+    return ParseError(error_message(error), text, min(offset, len(text)))
+
+
+def split_statements(text):
+    """Splits a diagram source into its header and the list of its top-level
+    statement chunks. Returns None if the text does not have the shape
+    `header { statements }`, in which case the caller should fall back to a
+    full parse."""
+    header = None
+    chunks = []
+    depth = 0
+    chunk_start = pending = None
+    for i, char in significant_chars(text):
+        if depth == 0 and header is not None:
+            return None
+        if pending is not None and char != ';':
+            chunks.append(text[chunk_start:pending])
+            chunk_start = pending
+        pending = None
+        if char == '{':
+            if depth == 0:
+                header = text[:i]
+                chunk_start = i + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                chunks.append(text[chunk_start:i])
+            elif depth == 1:
+                pending = i + 1
+        elif char == ';' and depth == 1:
+            chunks.append(text[chunk_start:i + 1])
+            chunk_start = i + 1
+    if header is None or depth != 0:
+        return None
+    return header, [chunk for chunk in chunks if chunk.strip()]
+
+
+def replace_fields(tree, **fields):
+    """Returns a copy of a parsed tree or statement with some fields
+    replaced. The trees of seqdiag 0.8 are tuples that cannot be changed and
+    have no _replace(), so they are built again from their fields."""
+    if isinstance(tree, tuple):
+        ## a tree of the same type holding the index of each field
+        indexes = type(tree)(*range(len(tree)))
+        values = list(tree)
+        for name, value in fields.items():
+            values[getattr(indexes, name)] = value
+        return type(tree)(*values)
+    tree = copy.copy(tree)
+    for name, value in fields.items():
+        setattr(tree, name, value)
+    return tree
+
+
+def with_statements(tree, stmts):
+    """Returns a copy of a parsed diagram tree holding the given statements"""
+    return replace_fields(tree, stmts=stmts)
+
+
+class IncrementalParser(object):
+    """Parses diagram sources, reusing the parse result of every top-level
+    statement that is unchanged since an earlier call. Parse errors are
+    located in the whole source, as a full parse would locate them."""
+
+    def __init__(self, max_statements=MAX_CACHED_STATEMENTS):
+        self.max_statements = max_statements
+        self.reparsed = 0
+        self.reused = 0
+        self._statements = OrderedDict()
+        self._skeletons = {}
+        self._lock = threading.Lock()
+
+    def parse(self, text):
+        """Returns the parsed tree of a diagram source. Raises ParseError,
+        located at the statement that holds it, if the source is not a valid
+        diagram."""
+        return self._parse(text, None)
+
+    def parse_recovering(self, text):
+        """Returns the parsed tree of a diagram source without its broken
+        statements, and the list of their ParseErrors. Raises ParseError if
+        the source does not even have the shape of a diagram."""
+        errors = []
+        return self._parse(text, errors), errors
+
+    def _parse(self, text, errors):
+        """Parses a diagram source. Broken statements raise their error,
+        unless an `errors` list is given to collect them in."""
+        parser = seqdiag_parser()
+        split = split_statements(text)
+        if split is None:
+            try:
+                return parser.parse_string(text)
+            except parser.ParseException as error:
+                raise located_error(error, text)
+        header, chunks = split
+        with self._lock:
+            self.max_statements = max(self.max_statements, 2 * len(chunks))
+            tree = self._parse_cold(text, chunks)
+            if tree is not None:
+                return tree
+            try:
+                skeleton = self._skeleton(header)
+            except parser.ParseException as error:
+                raise located_error(error, text, 0, header + '{}')
+            stmts = []
+            start = len(header)
+            for chunk in chunks:
+                start = text.find(chunk, start)
+                try:
+                    stmts.extend(self._statement(chunk))
+                except parser.ParseException as error:
+                    ## the chunk was parsed without its leading blanks,
+                    ## after a '{' line
+                    lead = len(chunk) - len(chunk.lstrip())
+                    located = located_error(
+                        error, text, start + lead,
+                        '{\n' + chunk.strip() + '\n}', 2)
+                    if errors is None:
+                        raise located
+                    errors.append(located)
+                start += len(chunk)
+            self._trim()
+        ## as a full parse does; what the statements hold is already sorted
+        stmts.sort(key=lambda stmt:
+                   type(stmt).__name__ not in ATTRIBUTE_STATEMENTS)
+        return with_statements(skeleton, stmts)
+
+    def _parse_cold(self, text, chunks):
+        """Parses a whole diagram source at once if too few of its
+        statements are cached, and caches them. Returns None if enough of
+        them are cached, or if the source does not parse, so that it is
+        parsed statement by statement and its errors located."""
+        keys = [chunk.strip() for chunk in chunks]
+        cached = sum(1 for key in keys if key in self._statements)
+        if cached >= MIN_CACHED_FRACTION * len(keys):
+            return None
+        parser = seqdiag_parser()
+        try:
+            ## parse() leaves the statements in source order; parse_string()
+            ## would sort them
+            tree = parser.parse(parser.tokenize(text))
+        except Exception:
+            return None
+        self.reparsed += len(keys)
+        ## only chunks holding nothing but comments have no statement, so if
+        ## the other chunks are as many as the statements, each holds one
+        keys = [key for key in keys if any(significant_chars(key))]
+        if len(keys) == len(tree.stmts):
+            for key, stmt in zip(keys, tree.stmts):
+                self._statements.pop(key, None)
+                self._statements[key] = (stmt,)
+            self._trim()
+        ## sorted while no other thread can see the statements yet
+        return parser.sort_tree(tree)
+
+    def clear(self):
+        """Forgets every cached statement"""
+        with self._lock:
+            self._statements.clear()
+            self._skeletons.clear()
+
+    def _skeleton(self, header):
+        """Returns the parsed tree of an empty diagram with this header"""
+        if header not in self._skeletons:
+            self._skeletons[header] = seqdiag_parser().parse_string(
+                header + '{}')
+        return self._skeletons[header]
+
+    def _statement(self, chunk):
+        """Returns the parsed statements of a chunk of the diagram body"""
+        key = chunk.strip()
+        if key in self._statements:
+            self.reused += 1
+            stmts = self._statements.pop(key)
+        else:
+            self.reparsed += 1
+            tree = seqdiag_parser().parse_string('{\n' + key + '\n}')
+            stmts = tuple(tree.stmts)
+        self._statements[key] = stmts
+        return stmts
+
+    def _trim(self):
+        """Forgets the least recently used statements past the limit"""
+        while len(self._statements) > self.max_statements:
+            self._statements.popitem(last=False)
@@ -0,0 +1,149 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    instrumentation.py
+Author:
+    Luis Osa <logc>
+Description:
+    Timing hooks for the hot paths of rendering. Every stage keeps its recent
+    timings in a ring buffer; the breakdown of the last render can be shown to
+    the user, and the whole session can be exported as JSON histograms or
+    captured with cProfile.
+"""
+import cProfile
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+RING_SIZE = 512
+## upper bounds, in milliseconds, of the histogram buckets
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+## the kind of render of the editor, which threads that never begin a render
+## of their own, such as the GUI thread, contribute to
+INTERACTIVE = 'interactive'
+
+
+class Instruments(object):
+    """Collects the timings of render stages for the current session"""
+
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.samples = OrderedDict()
+        ## the breakdown of the last render of every kind
+        self.last = {}
+        self.profiler = None
+        self._lock = threading.Lock()
+        self._thread = threading.local()
+
+    def begin_render(self, kind=INTERACTIVE):
+        """Starts the breakdown of a new render of a kind, e.g. interactive
+        renders or exports, on the current thread"""
+        self._thread.kind = kind
+        with self._lock:
+            self.last[kind] = OrderedDict()
+
+    def record(self, stage, elapsed):
+        """Records that a stage took `elapsed` seconds. Several calls for the
+        same stage within one render add up in the breakdown of the kind of
+        render the current thread began last."""
+        kind = getattr(self._thread, 'kind', INTERACTIVE)
+        with self._lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.size)
+            self.samples[stage].append(elapsed)
+            last = self.last.setdefault(kind, OrderedDict())
+            last[stage] = last.get(stage, 0.0) + elapsed
+
+    def timed(self, stage):
+        """Decorates a function so that every call is recorded under
+        `stage`"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.time()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(stage, time.time() - start)
+            return wrapper
+        return decorator
+
+    def summary(self, kind=INTERACTIVE):
+        """Returns a one-line breakdown of the last render of a kind"""
+        with self._lock:
+            return '  '.join('{0}: {1:.0f} ms'.format(stage, elapsed * 1000)
+                             for stage, elapsed in
+                             self.last.get(kind, {}).items())
+
+    def histograms(self):
+        """Returns the statistics and histogram of every stage, as a
+        JSON-friendly value"""
+        with self._lock:
+            samples = [(stage, sorted(values))
+                       for stage, values in self.samples.items()]
+        result = OrderedDict()
+        for stage, values in samples:
+            if not values:
+                continue
+            counts = [0] * (len(BUCKETS_MS) + 1)
+            for value in values:
+                milliseconds = value * 1000
+                index = 0
+                while index < len(BUCKETS_MS) and \
+                        milliseconds > BUCKETS_MS[index]:
+                    index += 1
+                counts[index] += 1
+            result[stage] = OrderedDict([
+                ('count', len(values)),
+                ('min_ms', values[0] * 1000),
+                ('median_ms', values[len(values) // 2] * 1000),
+                ('p90_ms', values[int(len(values) * 0.9)] * 1000),
+                ('max_ms', values[-1] * 1000),
+                ('mean_ms', sum(values) * 1000 / len(values)),
+                ('buckets_ms', list(BUCKETS_MS) + ['inf']),
+                ('counts', counts)])
+        return result
+
+    def dump(self, path):
+        """Writes the histograms of the session to a JSON file"""
+        with open(path, 'w') as output:
+            json.dump(self.histograms(), output, indent=2)
+
+    def start_profile(self):
+        """Starts capturing the renders with cProfile"""
+        self.profiler = cProfile.Profile()
+
+    def stop_profile(self, path=None):
+        """Stops capturing and writes the capture to `path`, in the format
+        read by the pstats module"""
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None and path:
+            profiler.dump_stats(path)
+
+    def call(self, function, *args):
+        """Calls a function, under the profiler while a capture runs. A
+        profiler only sees the thread it runs on, so render threads call
+        their work through here."""
+        profiler = self.profiler
+        if profiler is None:
+            return function(*args)
+        return profiler.runcall(function, *args)
+
+
+INSTRUMENTS = Instruments()
+timed = INSTRUMENTS.timed
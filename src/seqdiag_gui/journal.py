@@ -0,0 +1,451 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    journal.py
+Author:
+    Luis Osa <logc>
+Description:
+    Keeps unsaved edits safe. The edits of every document are appended to a
+    journal file as small text deltas, by a background writer that syncs them
+    to disk in batches and compacts journals that grow long. Journals left
+    behind by a session that did not end cleanly can be replayed to recover
+    the text. Each journal is locked by the process that writes it, so that
+    other running instances leave it alone. Sources are saved by rewriting
+    only what changed since they were last saved. This module does not
+    depend on wx.
+"""
+import Queue
+import codecs
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    ## e.g. on Windows, where journals are not locked against other
+    ## running instances
+    fcntl = None
+
+JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.seqdiag_gui',
+                           'journal')
+JOURNAL_EXTENSION = '.journal'
+## the lock of a journal is taken on a file next to it, with this extension
+## added, as the journal itself is replaced whenever it is compacted
+LOCK_EXTENSION = '.lock'
+## the writer gathers records for this long before syncing them together
+BATCH_SECONDS = 1.0
+## a journal is rewritten as a single snapshot after this many deltas
+COMPACT_RECORDS = 200
+## journals that cannot be replayed are moved to this subdirectory, where
+## their edits can still be read by hand, and deleted after this long
+QUARANTINE_DIR = 'unreplayable'
+QUARANTINE_SECONDS = 30 * 24 * 60 * 60
+## a saved source is compared with the file in blocks of this many bytes
+READ_BYTES = 1024 * 1024
+
+## the open lock files of the journals this process holds, by journal path
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+
+
+def common_prefix(first, second):
+    """Returns the length of the common prefix of two strings. Slices are
+    compared in halving steps, which is much faster in Python than walking
+    characters one at a time."""
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[low:middle] == second[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def common_suffix(first, second, limit):
+    """Returns the length of the common suffix of two strings, up to
+    `limit`"""
+    low, high = 0, min(len(first), len(second), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[len(first) - middle:len(first) - low] == \
+                second[len(second) - middle:len(second) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def text_delta(old, new):
+    """Returns (start, end, text) such that replacing old[start:end] with
+    text gives `new`"""
+    start = common_prefix(old, new)
+    suffix = common_suffix(old, new, min(len(old), len(new)) - start)
+    return start, len(old) - suffix, new[start:len(new) - suffix]
+
+
+def digest(text):
+    """Returns a fingerprint of a text"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _holds(source, prefix):
+    """Returns whether an open file starts with the bytes `prefix`, reading
+    it in blocks of READ_BYTES"""
+    source.seek(0)
+    for start in xrange(0, len(prefix), READ_BYTES):
+        expected = prefix[start:start + READ_BYTES]
+        if source.read(len(expected)) != expected:
+            return False
+    return True
+
+
+def write_changes(path, saved, text, encoding='utf-8', bom=''):
+    """Saves `text` to a source file that held `saved` when it was last read
+    or written, rewriting only the bytes from the first change onwards. The
+    whole file is written when it does not hold `saved` any more: when its
+    size changed, or when the bytes before the first change differ, e.g.
+    because another program edited it. Returns the number of bytes
+    written."""
+    start = common_prefix(saved, text)
+    prefix = bom + text[:start].encode(encoding)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = None
+    source = None
+    if size == len(bom) + len(saved.encode(encoding)):
+        source = open(path, 'r+b')
+        if not _holds(source, prefix):
+            source.close()
+            source = None
+    if source is None:
+        offset, tail = 0, bom + text.encode(encoding)
+        source = open(path, 'wb')
+    else:
+        offset, tail = len(prefix), text[start:].encode(encoding)
+    with source:
+        source.seek(offset)
+        source.write(tail)
+        source.truncate()
+        source.flush()
+        os.fsync(source.fileno())
+    return len(tail)
+
+
+def _line(record):
+    """Returns the journal line of a record"""
+    return json.dumps(record) + '\n'
+
+
+def lock_journal(path):
+    """Takes the lock of the journal at `path`, unless another running
+    process holds it. Returns whether this process holds it now. The lock
+    lasts until it is released, or until the process ends, however it
+    ends."""
+    with _LOCKS_LOCK:
+        if path in _LOCKS:
+            return True
+        lockfile = open(path + LOCK_EXTENSION, 'ab')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                lockfile.close()
+                return False
+        _LOCKS[path] = lockfile
+        return True
+
+
+def unlock_journal(path):
+    """Releases the lock of a journal that is gone, and deletes its lock
+    file"""
+    with _LOCKS_LOCK:
+        lockfile = _LOCKS.pop(path, None)
+        if lockfile is None:
+            return
+        try:
+            os.remove(path + LOCK_EXTENSION)
+        except OSError:
+            pass
+        lockfile.close()
+
+
+def remove_journal(path):
+    """Deletes a journal this process holds the lock of, and releases it"""
+    if os.path.exists(path):
+        os.remove(path)
+    unlock_journal(path)
+
+
+class Journal(object):
+    """The journal of one document. Edits are recorded against the text the
+    document was opened or saved with, its base; the journal file is only
+    created by the first edit. Journals of documents read from a source file
+    start from the file, the others from a snapshot of the text."""
+
+    def __init__(self, writer, header, base):
+        self.writer = writer
+        self.header = dict(header, op='open', base_sha1=digest(base))
+        self.path = os.path.join(writer.directory,
+                                 uuid.uuid4().hex + JOURNAL_EXTENSION)
+        self.text = base
+        self.records = None
+
+    def record(self, text):
+        """Records the text of the document, if it changed"""
+        if text == self.text:
+            return
+        start, end, inserted = text_delta(self.text, text)
+        delta = _line({'op': 'delta', 'start': start, 'end': end,
+                       'text': inserted})
+        if self.records is None and self.header.get('source'):
+            self.records = 1
+            self.writer.rewrite(self.path, [_line(self.header), delta])
+        elif self.records is None or self.records >= COMPACT_RECORDS:
+            self.records = 0
+            self.writer.rewrite(self.path, [
+                _line(self.header), _line({'op': 'snapshot', 'text': text})])
+        else:
+            self.records += 1
+            self.writer.append(self.path, delta)
+        self.text = text
+
+    @classmethod
+    def resume(cls, writer, path, header, text):
+        """Returns the journal of a document recovered from the journal file
+        at `path`, which goes on being used under the lock recover() took.
+        The next edit compacts it."""
+        journal = cls(writer, header, text)
+        journal.header = header
+        journal.path = path
+        journal.records = COMPACT_RECORDS
+        return journal
+
+    def rebase(self, base, **header):
+        """Starts over from a new base, once the document has been saved"""
+        self.header.update(header, base_sha1=digest(base))
+        self.text = base
+        self.discard()
+
+    def discard(self):
+        """Deletes the journal file, if there is one"""
+        if self.records is not None:
+            self.records = None
+            self.writer.delete(self.path)
+
+
+class JournalWriter(threading.Thread):
+    """Writes the journals of every document on a background thread. Records
+    are appended and flushed as they arrive, and synced to disk together once
+    per batch."""
+
+    def __init__(self, directory=JOURNAL_DIR, batch_seconds=BATCH_SECONDS):
+        super(JournalWriter, self).__init__(name='JournalWriter')
+        self.daemon = True
+        self.directory = directory
+        self.batch_seconds = batch_seconds
+        self._jobs = Queue.Queue()
+        self._files = {}
+
+    def journal(self, base, **header):
+        """Returns a new journal for a document opened with the text `base`.
+        The header describes the document, e.g. its `source` file."""
+        return Journal(self, header, base)
+
+    def append(self, path, line):
+        """Queues a line to append to a journal"""
+        self._jobs.put(('append', path, line))
+
+    def rewrite(self, path, lines):
+        """Queues replacing a journal with the given lines"""
+        self._jobs.put(('rewrite', path, lines))
+
+    def delete(self, path):
+        """Queues deleting a journal"""
+        self._jobs.put(('delete', path, None))
+
+    def stop(self):
+        """Asks the writer to sync what it has written, and finish"""
+        self._jobs.put(None)
+
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            deadline = time.time() + self.batch_seconds
+            touched = set()
+            while job is not None:
+                self._do(job, touched)
+                try:
+                    job = self._jobs.get(
+                        timeout=max(0.0, deadline - time.time()))
+                except Queue.Empty:
+                    break
+            for path in touched:
+                if path in self._files:
+                    os.fsync(self._files[path].fileno())
+            if job is None:
+                break
+        for journalfile in self._files.values():
+            journalfile.close()
+
+    def _do(self, job, touched):
+        """Carries out one queued job"""
+        kind, path, payload = job
+        if kind == 'append':
+            journalfile = self._open(path)
+            journalfile.write(payload)
+            journalfile.flush()
+            touched.add(path)
+        elif kind == 'rewrite':
+            self._close(path)
+            ## new journals are locked before they appear
+            lock_journal(path)
+            handle, tmpname = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(handle, 'wb') as journalfile:
+                journalfile.writelines(payload)
+                journalfile.flush()
+                os.fsync(journalfile.fileno())
+            os.rename(tmpname, path)
+        elif kind == 'delete':
+            self._close(path)
+            touched.discard(path)
+            remove_journal(path)
+
+    def _open(self, path):
+        """Returns the open journal file at `path`"""
+        if path not in self._files:
+            self._files[path] = open(path, 'ab')
+        return self._files[path]
+
+    def _close(self, path):
+        """Closes a journal file, if it is open"""
+        journalfile = self._files.pop(path, None)
+        if journalfile is not None:
+            journalfile.close()
+
+    def start(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        super(JournalWriter, self).start()
+
+
+def replay(path):
+    """Returns the header of a journal, the text of its source file and the
+    text the journal leads to, or None if the journal cannot be replayed,
+    e.g. because its source file changed. The source text is None for
+    documents without a source."""
+    header, base, text = None, None, None
+    with open(path, 'rb') as journalfile:
+        for line in journalfile:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                ## a record cut short by a crash ends the journal
+                break
+            if record['op'] == 'open':
+                header = record
+                base = text = _base_text(record)
+            elif record['op'] == 'snapshot':
+                text = record['text']
+            elif text is None:
+                return None
+            elif record['op'] == 'delta':
+                text = text[:record['start']] + record['text'] + \
+                    text[record['end']:]
+    if header is None or text is None:
+        return None
+    return header, base, text
+
+
+def _base_text(header):
+    """Returns the base text of a journal from its source file, or None if
+    the source does not hold it any more"""
+    source = header.get('source')
+    if not source:
+        return None
+    try:
+        with codecs.open(source, 'r', header.get('encoding', 'utf-8')) as f:
+            text = f.read()
+    except (IOError, UnicodeDecodeError):
+        return None
+    if text.startswith(u'\ufeff'):
+        text = text[1:]
+    return text if digest(text) == header['base_sha1'] else None
+
+
+def quarantine(path):
+    """Moves a journal that cannot be replayed out of the way of recover(),
+    into the QUARANTINE_DIR next to it"""
+    directory = os.path.join(os.path.dirname(path), QUARANTINE_DIR)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    os.rename(path, os.path.join(directory, os.path.basename(path)))
+
+
+def purge_quarantine(directory=JOURNAL_DIR, max_age=QUARANTINE_SECONDS):
+    """Deletes the quarantined journals of a directory older than `max_age`
+    seconds"""
+    directory = os.path.join(directory, QUARANTINE_DIR)
+    if not os.path.isdir(directory):
+        return
+    oldest = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def recover(directory=JOURNAL_DIR):
+    """Returns the path, header, source text and text of every journal left
+    in a directory that can be replayed, and takes their locks. Journals
+    locked by other running processes are left alone. The others are
+    quarantined, and the journals quarantined long ago deleted."""
+    sessions = []
+    if not os.path.isdir(directory):
+        return sessions
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(JOURNAL_EXTENSION + LOCK_EXTENSION):
+            ## the lock of a journal whose writer ended before writing it
+            path = path[:-len(LOCK_EXTENSION)]
+            if not os.path.exists(path) and lock_journal(path):
+                unlock_journal(path)
+            continue
+        if not name.endswith(JOURNAL_EXTENSION) or not lock_journal(path):
+            continue
+        try:
+            result = replay(path)
+        except (IOError, KeyError, TypeError):
+            result = None
+        if result is not None:
+            sessions.append((path,) + result)
+        else:
+            try:
+                quarantine(path)
+            except OSError:
+                pass
+            unlock_journal(path)
+    purge_quarantine(directory)
+    return sessions
@@ -0,0 +1,156 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    loading.py
+Author:
+    Luis Osa <logc>
+Description:
+    Loads large diagram sources piece by piece. Files are memory-mapped and
+    decoded in chunks, so that the editor can take them in a little at a time
+    and the first diagram can be rendered before the whole file is read. This
+    module does not depend on wx.
+"""
+import codecs
+import mmap
+import os
+
+from incremental import DiagramEndScanner
+
+CHUNK_SIZE = 256 * 1024
+SNIFF_SIZE = 64 * 1024
+BOMS = ((codecs.BOM_UTF32_LE, 'utf-32-le'), (codecs.BOM_UTF32_BE, 'utf-32-be'),
+        (codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'),
+        (codecs.BOM_UTF16_BE, 'utf-16-be'))
+
+
+def detect_encoding(head):
+    """Returns the encoding of a file starting with the bytes `head`, and the
+    length of its byte order mark. Files without a mark are taken as UTF-8
+    if their start decodes as such, and as Latin-1 otherwise. The rest of
+    the file may still turn out not to be UTF-8; reading it then raises
+    LoadError."""
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+    except UnicodeDecodeError:
+        return 'latin-1', 0
+    return 'utf-8', 0
+
+
+class LoadError(ValueError):
+    """Raised when a file does not decode in the encoding detected from its
+    start, at a byte `offset` of it"""
+
+    def __init__(self, path, encoding, offset):
+        super(LoadError, self).__init__(
+            'not valid {0} at byte {1}'.format(encoding, offset))
+        self.path = path
+        self.encoding = encoding
+        self.offset = offset
+
+
+class ChunkedFile(object):
+    """Reads a file through a memory map as a sequence of decoded chunks"""
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        else:
+            self._map = ''
+        self.encoding, self.offset = detect_encoding(self._map[:SNIFF_SIZE])
+        self.bom = self._map[:self.offset]
+        self._decoder = codecs.getincrementaldecoder(self.encoding)()
+
+    @property
+    def progress(self):
+        """The fraction of the file read so far"""
+        return float(self.offset) / self.size if self.size else 1.0
+
+    def read_chunk(self):
+        """Returns the next decoded chunk, or None at the end of the file.
+        Raises LoadError if the chunk does not decode."""
+        if self.offset >= self.size:
+            return None
+        end = min(self.size, self.offset + self.chunk_size)
+        data = self._map[self.offset:end]
+        ## bytes of an incomplete character left from the previous chunk
+        pending = len(self._decoder.getstate()[0])
+        try:
+            chunk = self._decoder.decode(data, final=end == self.size)
+        except UnicodeDecodeError as error:
+            raise LoadError(self.path, self.encoding,
+                            self.offset - pending + error.start)
+        self.offset = end
+        return chunk
+
+    def close(self):
+        """Releases the memory map and the file"""
+        if self.size:
+            self._map.close()
+        self._file.close()
+
+
+class DocumentLoader(object):
+    """Feeds a file to an editor chunk by chunk, and notices when the text
+    read so far holds its first complete diagram"""
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.source = ChunkedFile(path, chunk_size)
+        self.encoding = self.source.encoding
+        self.bom = self.source.bom
+        self.first_diagram = None
+        self.done = False
+        ## the chunks read until the first diagram is found
+        self._head = []
+        self._scanner = DiagramEndScanner()
+
+    @property
+    def progress(self):
+        """The fraction of the file loaded so far"""
+        return self.source.progress
+
+    def step(self):
+        """Reads the next chunk and returns it; returns None and closes the
+        file once everything has been read. Raises LoadError, and closes
+        the file, if the rest of it is not in the detected encoding."""
+        try:
+            chunk = self.source.read_chunk()
+        except LoadError:
+            self.close()
+            raise
+        if chunk is None:
+            self.close()
+            return None
+        if self.first_diagram is None:
+            self._head.append(chunk)
+            end = self._scanner.feed(chunk)
+            if end is not None:
+                self.first_diagram = u''.join(self._head)[:end]
+                self._head = None
+        return chunk
+
+    def close(self):
+        """Stops loading and releases the file"""
+        if not self.done:
+            self.done = True
+            self.source.close()
@@ -19,14 +19,60 @@ Module main
 
 main is the entry point of this application.
 """
+import time
+_IMPORTS_STARTED = time.time()
+
+import argparse
+from collections import OrderedDict
+
 from wx import App
 
 import windows
 import controllers
+import seqdiagrams
+
+
+def build_parser():
+    """Builds the command line parser of the application"""
+    parser = argparse.ArgumentParser(prog='seqdiag_gui')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print where the time until the first diagram '
+                             'is shown goes')
+    parser.add_argument('--server', metavar='ADDRESS', default=None,
+                        help='render through a seqdiag_gui-server at '
+                             'host:port or unix:/path/to/socket')
+    parser.add_argument('--bands', type=int, default=seqdiagrams.BANDS,
+                        help='draw large diagrams in this many bands on as '
+                             'many processes')
+    return parser
 
 
-def run():
+def print_startup_profile(timings):
+    """Prints a breakdown of the time spent starting up"""
+    print 'Startup profile:'
+    for stage, elapsed in timings.items():
+        print '  {0:<32} {1:8.3f}s'.format(stage, elapsed)
+
+
+def run(argv=None):
     """Application entry point"""
+    options = build_parser().parse_args(argv)
+    seqdiagrams.BANDS = max(1, options.bands)
+    timings = OrderedDict()
+    timings['import wx and GUI modules'] = time.time() - _IMPORTS_STARTED
+    start = time.time()
     app = App(False)
-    controller = controllers.MainController(app)
+
+    def ready():
+        """Called once the first diagram is on screen"""
+        timings['first render, with imports and fonts'] = time.time() - shown
+        timings.update(sorted(seqdiagrams.STARTUP_TIMINGS.items()))
+        timings['total'] = time.time() - _IMPORTS_STARTED
+        if options.profile_startup:
+            print_startup_profile(timings)
+
+    controller = controllers.MainController(app, on_ready=ready,
+                                            server=options.server)
+    shown = time.time()
+    timings['create and show main window'] = shown - start
     app.MainLoop()
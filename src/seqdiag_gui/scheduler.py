@@ -0,0 +1,225 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    scheduler.py
+Author:
+    Luis Osa <logc>
+Description:
+    Decides which render work runs when. Interactive renders of the editor
+    go first, on their own worker; exports and renders of files run on a
+    small pool of background threads, by priority, and wait at every stage
+    while an interactive render is running. Requests for work already queued
+    or running are joined to it instead of being done twice. This module
+    does not depend on wx.
+"""
+import Queue
+import itertools
+import threading
+import traceback
+
+from batch import render_file
+from cache import cache_key
+from export import export
+from instrumentation import INSTRUMENTS
+from workers import RenderWorker
+
+## background priorities; lower numbers run first
+EXPORT, FILE = 1, 2
+_STOP = 3
+## the kinds of render the timings of background jobs are recorded under
+KINDS = {EXPORT: 'export', FILE: 'file'}
+BACKGROUND_WORKERS = 2
+## how often a paused background job checks whether it was cancelled
+POLL_SECONDS = 0.1
+
+
+class JobCancelled(Exception):
+    """Raised inside a background job that was cancelled"""
+
+
+class BackgroundJob(object):
+    """A unit of background work, and the callbacks of every request it
+    serves. `function` is called with the job, and returns the arguments
+    the `done` callbacks are called with; if it raises, `failed`, if given,
+    is called with the error and returns them instead."""
+
+    def __init__(self, key, priority, function, idle, failed=None):
+        self.key = key
+        self.priority = priority
+        self.function = function
+        self.failed = failed
+        self.progress = []
+        self.done = []
+        self.started = False
+        self.cancelled = False
+        self._idle = idle
+
+    def checkpoint(self):
+        """Waits while an interactive render is running. Raises JobCancelled
+        if the job was cancelled."""
+        while not self.cancelled and not self._idle.wait(POLL_SECONDS):
+            pass
+        if self.cancelled:
+            raise JobCancelled()
+
+    def report(self, *args):
+        """Calls the progress callbacks of every request"""
+        for progress in list(self.progress):
+            progress(*args)
+
+
+class RenderScheduler(object):
+    """Runs interactive renders ahead of background work. It is used like a
+    RenderWorker for interactive renders; exports and file renders are
+    queued with export() and render_files()."""
+
+    def __init__(self, interactive=None, workers=BACKGROUND_WORKERS):
+        self.interactive = interactive or RenderWorker()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._queue = Queue.PriorityQueue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+        self._threads = [
+            threading.Thread(target=self._serve,
+                             name='BackgroundRenderer-{0}'.format(number))
+            for number in range(max(1, workers))]
+        for thread in self._threads:
+            thread.daemon = True
+
+    def start(self):
+        """Starts the interactive worker and the background threads"""
+        self.interactive.start()
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, text, callback, render=None, preview=None):
+        """Queues an interactive render, as RenderWorker.submit does.
+        Background work pauses while it runs."""
+        render = render or self.interactive.render
+
+        def foreground(*args):
+            self._idle.clear()
+            try:
+                return render(*args)
+            finally:
+                self._idle.set()
+        return self.interactive.submit(text, callback, foreground, preview)
+
+    def is_current(self, generation):
+        """Returns whether no newer interactive render was submitted"""
+        return self.interactive.is_current(generation)
+
+    def cancel(self):
+        """Discards the pending and running interactive renders"""
+        self.interactive.cancel()
+
+    def schedule(self, key, priority, function, progress=None, done=None,
+                 join_running=True, failed=None):
+        """Queues background work and returns its job. Work with the same
+        `key` as a job that has not finished is joined to that job, unless
+        the job is already running and `join_running` is False, e.g. because
+        its input may have changed since it started. `failed` turns an error
+        raised by `function` into the arguments of the `done` callbacks;
+        without it, the error is only printed."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.cancelled or \
+                    (job.started and not join_running):
+                job = BackgroundJob(key, priority, function, self._idle,
+                                    failed)
+                self._jobs[key] = job
+                self._queue.put((priority, next(self._order), job))
+            if progress is not None:
+                job.progress.append(progress)
+            if done is not None:
+                job.done.append(done)
+        return job
+
+    def export(self, text, path, dpi, progress, done, collapse=False,
+               recover=False):
+        """Queues exporting a text to a file. `progress` is called with each
+        stage of the export, and `done` with the error that stopped it, or
+        None once the file is written."""
+        def run(job):
+            def report(stage, fraction):
+                job.checkpoint()
+                job.report(stage, fraction)
+            try:
+                export(text, path, dpi, report, collapse, recover)
+            except JobCancelled:
+                raise
+            except Exception as error:
+                return (error,)
+            return (None,)
+        key = ('export', path, dpi, collapse, recover, cache_key(text))
+        return self.schedule(key, EXPORT, run, progress, done,
+                             failed=lambda error: (error,))
+
+    def render_files(self, jobs, done):
+        """Queues rendering source files into image files, as the batch
+        renderer does. `done` is called with the source, elapsed time and
+        error of every file, the error being None on success."""
+        for source, target in jobs:
+            self.schedule(('file', source, target), FILE,
+                          lambda job, files=(source, target):
+                          render_file(files),
+                          done=done, join_running=False,
+                          failed=lambda error, source=source: (
+                              source, 0.0, '{0}: {1}'.format(
+                                  type(error).__name__, error)))
+
+    def stop(self):
+        """Cancels every job, and asks the worker threads to finish"""
+        self.interactive.stop()
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancelled = True
+            self._jobs.clear()
+        for _ in self._threads:
+            self._queue.put((_STOP, next(self._order), None))
+
+    def _serve(self):
+        """Runs background jobs until stopped. Errors raised by a job or by
+        its callbacks are reported, and do not stop the thread."""
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                break
+            try:
+                job.checkpoint()
+                with self._lock:
+                    job.started = True
+                INSTRUMENTS.begin_render(KINDS.get(job.priority, 'background'))
+                result = job.function(job)
+            except JobCancelled:
+                continue
+            except Exception as error:
+                result = None
+                if job.failed is not None:
+                    result = job.failed(error)
+                else:
+                    traceback.print_exc()
+            with self._lock:
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+                callbacks = list(job.done) if result is not None else []
+            for done in callbacks:
+                try:
+                    done(*result)
+                except Exception:
+                    traceback.print_exc()
@@ -12,31 +12,658 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from seqdiag import parser
-from seqdiag.drawer import DiagramDraw
-from seqdiag.builder import ScreenNodeBuilder
+import cStringIO
+import functools
+import multiprocessing
+from array import array
+import threading
+import time
+import types
+from collections import namedtuple
+
+from cache import RenderCache, cache_key
+from folding import fold
+from fonts import FONTS, install as install_font_caches
+from incremental import IncrementalParser, ParseError
+from instrumentation import timed
 
 FORMAT = 'PNG'
 ANTIALIAS = False
 FONTPATH = None
+CACHE_DIR = None
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+CACHE_MAX_DISK_BYTES = 256 * 1024 * 1024
+## rasterise diagrams with at least BAND_MIN_EDGES messages in this many
+## horizontal bands, on a pool of processes; 1 draws the canvas at once
+BANDS = 1
+BAND_MIN_EDGES = 200
+## how far, in pixels, drawing calls may reach past the coordinates they are
+## given, as text does below its baseline
+BAND_MARGIN = 64
+## how many rows around an antialiased band are drawn and reduced with it
+BAND_RESIZE_MARGIN = 8
+## diagrams with at least PREVIEW_MIN_EDGES messages are first shown as a
+## sketch of at most PREVIEW_PIXELS pixels while they are drawn in full
+PREVIEW_MIN_EDGES = 100
+PREVIEW_PIXELS = 1024 * 1024
+PREVIEW_COLOURS = {'background': (255, 255, 255, 255),
+                   'line': (0, 0, 0, 255),
+                   'lifeline': (128, 128, 128, 255),
+                   'label': (192, 192, 192, 255)}
+## the canvas calls that paint, and are skipped when they miss a band
+DRAW_METHODS = ('line', 'arc', 'ellipse', 'rectangle', 'polygon', 'text',
+                'textarea', 'image', 'loadImage')
+
+
+class Raster(namedtuple('Raster', 'width height data')):
+    """A rendered diagram as an uncompressed RGBA pixel buffer"""
+    __slots__ = ()
+
+
+CACHE = RenderCache(CACHE_MAX_BYTES, CACHE_DIR,
+                    sizeof=lambda raster: len(raster.data),
+                    max_disk_bytes=CACHE_MAX_DISK_BYTES)
+PARSER = IncrementalParser()
+
+## seqdiag and PIL take a long time to import, so they are only imported by
+## load(), on first use; STARTUP_TIMINGS records how long that took
+parser = DiagramDraw = ScreenNodeBuilder = AutoScaler = None
+Image = ImageDraw = ImageFont = None
+STARTUP_TIMINGS = {}
+_LOAD_LOCK = threading.Lock()
+_BAND_POOL = None
+## seqdiag's builder keeps the elements it lays out, and their default
+## colours, on its element classes, so only one thread at a time may parse,
+## build and draw diagrams; a diagram must be drawn before another is built
+SEQDIAG_LOCK = threading.RLock()
+
+## attributes that move things around when they change, and attributes that
+## only change the way an element is painted
+DIAGRAM_LAYOUT_ATTRIBUTES = ('edge_length', 'span_height', 'fontsize',
+                             'node_width', 'node_height', 'activation',
+                             'autonumber', 'default_shape')
+NODE_LAYOUT_ATTRIBUTES = ('id', 'xy', 'colwidth', 'colheight', 'width',
+                          'height', 'fontsize', 'shape')
+## a message's row is as high as its label once wrapped between its ends,
+## which only the drawer measures, in `textheight`
+EDGE_LAYOUT_ATTRIBUTES = ('dir', 'order', 'fontsize', 'diagonal', 'failed',
+                          'return_label', 'activate', 'note', 'leftnote',
+                          'rightnote', 'textheight')
+## of groups, separators and blocks of messages, which are placed by their
+## members; unnamed groups get a new random id every time they are built
+OTHER_LAYOUT_ATTRIBUTES = ('type', 'order', 'xlevel', 'ylevel_top',
+                           'ylevel_bottom')
+COSMETIC_ATTRIBUTES = ('label', 'color', 'textcolor', 'linecolor',
+                       'background', 'style', 'stacked')
+
+
+def load():
+    """Imports seqdiag and PIL and loads the diagram font, unless that has
+    already been done. Safe to call from any thread."""
+    global parser, DiagramDraw, ScreenNodeBuilder, AutoScaler
+    global Image, ImageDraw, ImageFont
+    if parser is not None:
+        return
+    with _LOAD_LOCK:
+        if parser is not None:
+            return
+        start = time.time()
+        try:
+            from PIL import Image, ImageDraw, ImageFont
+        except ImportError:
+            import Image
+            import ImageDraw
+            import ImageFont
+        from seqdiag.drawer import DiagramDraw
+        from seqdiag.builder import ScreenNodeBuilder
+        from blockdiag.metrics import AutoScaler
+        from seqdiag import parser as seqdiag_parser
+        STARTUP_TIMINGS['import seqdiag and PIL'] = time.time() - start
+        start = time.time()
+        install_font_caches()
+        load_font()
+        STARTUP_TIMINGS['load fonts'] = time.time() - start
+        parser = seqdiag_parser
+
+
+def serialized(function):
+    """Decorates a function that parses, builds or draws diagrams so that it
+    runs while holding SEQDIAG_LOCK"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with SEQDIAG_LOCK:
+            return function(*args, **kwargs)
+    return wrapper
 
 
-def text2diagram(text):
+def load_font(size=11):
+    """Loads the font diagrams are drawn with, once per size"""
+    key = (FONTPATH, size)
+    font = FONTS.get(key)
+    if font is None:
+        if FONTPATH:
+            font = ImageFont.truetype(FONTPATH, size)
+        else:
+            font = ImageFont.load_default()
+        FONTS.put(key, font)
+    return font
+
+
+@serialized
+@timed('text2diagram')
+def text2diagram(text, collapse=False, errors=None, recover=False):
     """Converts a text to an abstract diagram, which is not yet a
-    representable image"""
+    representable image, or returns None if the text is not a valid diagram.
+    Only the statements that changed since a previous call are parsed again.
+    With `collapse`, repeated runs of messages are folded into one; with
+    `recover`, broken statements are left out of the diagram.
+
+    The ParseErrors found are added to the `errors` list, if given."""
+    load()
     try:
-        tree = parser.parse_string(text)
-    except parser.ParseException:
+        if recover:
+            tree, skipped = PARSER.parse_recovering(text)
+            if errors is not None:
+                errors.extend(skipped)
+        else:
+            tree = PARSER.parse(text)
+    except ParseError as error:
+        if errors is not None:
+            errors.append(error)
         return None
+    if collapse:
+        tree = fold(tree)
     return ScreenNodeBuilder.build(tree)
 
 
-def diagram2png(diagram):
-    """Converts an abstract diagram into a representable image"""
+@serialized
+def new_drawer(diagram, scale_ratio=None):
+    """Returns a drawer for an abstract diagram, laid out on its canvas.
+    `scale_ratio`, a whole number, draws the canvas that many times larger
+    than the layout, instead of the ratio antialiasing uses."""
+    load()
     drawer = DiagramDraw(FORMAT, diagram,
                          font=FONTPATH,
-                         antialias=ANTIALIAS,
+                         antialias=ANTIALIAS and scale_ratio is None,
                          transparency=True)
+    if scale_ratio is not None and scale_ratio != 1:
+        ## what the drawer sets up itself for antialiasing, at another ratio
+        drawer.scale_ratio = drawer.drawer.target.scale_ratio = scale_ratio
+        drawer.metrics = AutoScaler(drawer.metrics, scale_ratio=scale_ratio)
+        drawer.drawer.set_options(jump_radius=drawer.metrics.cellsize / 2)
+    return drawer
+
+
+def _pixels(image):
+    """Returns the RGBA pixels of a PIL image"""
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    tobytes = getattr(image, 'tobytes', None) or image.tostring
+    return tobytes()
+
+
+@serialized
+@timed('diagram2png')
+def diagram2png(diagram):
+    """Converts an abstract diagram into a representable image"""
+    drawer = new_drawer(diagram)
     drawer.draw()
     img = drawer.save()
     return img
+
+
+def painted_image(canvas):
+    """Returns the PIL image of a drawer's canvas once painted. The canvas
+    only records the drawing calls until it is saved, and then searches the
+    crossings of its lines and replays them on its target; this saves it
+    without encoding the image."""
+    target = canvas.target
+    target.save = lambda *args, **kwargs: target._image
+    try:
+        return canvas.save(None, None, FORMAT)
+    finally:
+        del target.save
+
+
+@serialized
+@timed('diagram2raster')
+def diagram2raster(diagram, drawer=None):
+    """Converts an abstract diagram into a raster image, taking the pixels
+    straight from the drawer's canvas without encoding them. `drawer` is a
+    new drawer of the diagram, if one was already made."""
+    drawer = drawer or new_drawer(diagram)
+    drawer.draw()
+    image = painted_image(drawer.drawer)
+    ratio = drawer.drawer.target.scale_ratio
+    if ratio != 1:
+        ## the same reduction that drawer.save() applies to antialiased images
+        image = image.resize((int(image.size[0] / ratio),
+                              int(image.size[1] / ratio)), Image.ANTIALIAS)
+    return Raster(image.size[0], image.size[1], _pixels(image))
+
+
+def _label_bar(draw, box, scale):
+    """Sketches the label in a box (x1, y1, x2, y2) as a bar"""
+    x1, y1, x2, y2 = [value * scale for value in box]
+    inset_x, inset_y = (x2 - x1) * 0.1, (y2 - y1) * 0.3
+    draw.rectangle([x1 + inset_x, y1 + inset_y, x2 - inset_x, y2 - inset_y],
+                   fill=PREVIEW_COLOURS['label'])
+
+
+@serialized
+@timed('diagram2preview')
+def diagram2preview(diagram, max_pixels=PREVIEW_PIXELS):
+    """Sketches an abstract diagram quickly: participants, lifelines and
+    messages as plain shapes without antialiasing, labels as bars, at a
+    resolution of at most `max_pixels` pixels. Returns the raster and its
+    scale against the full render."""
+    drawer = new_drawer(diagram)
+    ## antialiased drawers scale their metrics up; the sketch is not
+    metrics = getattr(drawer.metrics, 'subject', drawer.metrics)
+    width, height = drawer.pagesize()
+    scale = min(1.0, (max_pixels / float(max(1, width * height))) ** 0.5)
+    image = Image.new('RGBA', (max(1, int(width * scale)),
+                               max(1, int(height * scale))),
+                      PREVIEW_COLOURS['background'])
+    draw = ImageDraw.Draw(image)
+
+    def scaled(points):
+        return [(x * scale, y * scale) for x, y in points]
+    for node in diagram.nodes:
+        box = metrics.cell(node).box
+        middle = (box[0] + box[2]) / 2.0
+        draw.line(scaled([(middle, box[3]), (middle, height)]),
+                  fill=PREVIEW_COLOURS['lifeline'])
+        draw.rectangle(scaled([(box[0], box[1]), (box[2], box[3])]),
+                       fill=PREVIEW_COLOURS['background'],
+                       outline=PREVIEW_COLOURS['line'])
+        if getattr(node, 'label', None):
+            _label_bar(draw, box, scale)
+    for edge in diagram.edges:
+        edge_metrics = metrics.edge(edge)
+        draw.line(scaled(list(edge_metrics.shaft)),
+                  fill=PREVIEW_COLOURS['line'])
+        if getattr(edge, 'label', None):
+            _label_bar(draw, edge_metrics.textbox, scale)
+    return Raster(image.size[0], image.size[1], _pixels(image)), scale
+
+
+def _vertical_extent(value):
+    """Returns the y coordinates found in an argument of a drawing call:
+    points are pairs of numbers, boxes are fours, and lists of points or
+    boxes are searched through"""
+    if not isinstance(value, (tuple, list)) or not value:
+        return []
+    if all(isinstance(item, (int, long, float)) for item in value):
+        if len(value) == 2:
+            return [value[1]]
+        if len(value) == 4:
+            return [value[1], value[3]]
+        return []
+    ys = []
+    for item in value:
+        ys.extend(_vertical_extent(item))
+    return ys
+
+
+def _call_name(method):
+    """Returns the name of the canvas method of a drawing call the canvas
+    recorded, or None for calls on canvases derived from it"""
+    if isinstance(method, basestring):
+        return method
+    if isinstance(method, types.FunctionType):
+        return method.__name__
+    return None
+
+
+def clip_calls(canvas, top, bottom, ratio=1):
+    """Drops the drawing calls a drawer's canvas recorded that cannot paint
+    within the rows from `top` to `bottom` of the painted canvas, before
+    they are replayed on its target. The calls made before an antialiased
+    canvas is enlarged by its scale `ratio` are drawn at its original size.
+    Calls whose coordinates cannot be told are always kept."""
+    margin = BAND_MARGIN * ratio
+    scale = ratio
+    kept = []
+    for call in canvas.calls:
+        name = _call_name(call[0])
+        if name == 'resizeCanvas':
+            scale = 1
+        elif name in DRAW_METHODS:
+            ys = []
+            for value in call[1] + tuple(call[2].values()):
+                ys.extend(_vertical_extent(value))
+            if ys and (max(ys) * scale < top - margin or
+                       min(ys) * scale > bottom + margin):
+                continue
+        kept.append(call)
+    canvas.calls = kept
+
+
+@serialized
+def draw_band(job):
+    """Draws one of `bands` horizontal bands of a text, in a pool process.
+    Returns the width and height of the whole diagram and the pixels of the
+    band, or None if the text is not a valid diagram."""
+    text, collapse, recover, band, bands = job
+    diagram = text2diagram(text, collapse, recover=recover)
+    if diagram is None:
+        return None
+    drawer = new_drawer(diagram)
+    drawer.draw()
+    canvas = drawer.drawer
+    ratio = canvas.target.scale_ratio
+    width, height = drawer.pagesize()
+    top, bottom = height * band // bands, height * (band + 1) // bands
+    ## antialiased canvases are reduced with some rows around the band, so
+    ## that the rows of the band are reduced as those of the whole canvas
+    margin = 0 if ratio == 1 else BAND_RESIZE_MARGIN
+    first, last = max(0, top - margin), min(height, bottom + margin)
+    clip_calls(canvas, first * ratio, last * ratio, ratio)
+    image = painted_image(canvas).crop((0, first * ratio, width * ratio,
+                                        last * ratio))
+    if ratio != 1:
+        image = image.resize((width, last - first), Image.ANTIALIAS)
+    return width, height, _pixels(image.crop((0, top - first, width,
+                                              bottom - first)))
+
+
+def band_pool(processes=None):
+    """Returns the pool of processes that draws bands, starting it on first
+    use"""
+    global _BAND_POOL
+    if _BAND_POOL is None:
+        _BAND_POOL = multiprocessing.Pool(processes or BANDS,
+                                          initializer=load)
+    return _BAND_POOL
+
+
+@timed('draw bands')
+def text2raster_bands(text, bands=None, collapse=False, pool=None,
+                      recover=False):
+    """Converts a text into a raster image by drawing horizontal bands of it
+    in parallel and stacking them, which gives the same pixels as drawing
+    it at once. Returns None if the text is not a valid diagram."""
+    bands = bands or BANDS
+    results = (pool or band_pool()).map(
+        draw_band, [(text, collapse, recover, band, bands)
+                    for band in range(bands)])
+    if None in results:
+        return None
+    width, height = results[0][:2]
+    return Raster(width, height, ''.join(data for _, _, data in results))
+
+
+def raster2image(raster):
+    """Wraps a raster in a PIL image, without copying its pixels"""
+    load()
+    return Image.frombuffer('RGBA', (raster.width, raster.height),
+                            raster.data, 'raw', 'RGBA', 0, 1)
+
+
+def raster2png(raster):
+    """Encodes a raster as a PNG image"""
+    stream = cStringIO.StringIO()
+    raster2image(raster).save(stream, FORMAT)
+    return stream.getvalue()
+
+
+def render_key(text, collapse=False, recover=False):
+    """Returns the cache key of the render of a text with the current
+    options. `recover` tells a render that left broken statements out, which
+    is kept apart from the render of the text as it is."""
+    options = (FORMAT, ANTIALIAS, FONTPATH)
+    if collapse:
+        options += ('collapse',)
+    if recover:
+        options += ('recover',)
+    return cache_key(text, *options)
+
+
+@serialized
+def text2raster(text, cache=CACHE):
+    """Converts a text directly into a raster image, reusing a previous
+    render of the same text and options when there is one. Returns None if the
+    text is not a valid diagram."""
+    key = render_key(text)
+    raster = cache.get(key)
+    if raster is None:
+        diagram = text2diagram(text)
+        if diagram is None:
+            return None
+        raster = diagram2raster(diagram)
+        cache.put(key, raster)
+    return raster
+
+
+def text2png(text, cache=CACHE):
+    """Converts a text directly into a representable image. Returns None if
+    the text is not a valid diagram."""
+    raster = text2raster(text, cache)
+    if raster is None:
+        return None
+    return raster2png(raster)
+
+
+def _attributes(element, names):
+    """Returns the values of the named attributes of a diagram element"""
+    return tuple(getattr(element, name, None) for name in names)
+
+
+def _members(element):
+    """Returns the ids of the participants and the orders of the messages in
+    a group or a block of messages"""
+    return (tuple(node.id for node in getattr(element, 'nodes', ())),
+            tuple(edge.order for edge in getattr(element, 'edges', ())))
+
+
+class InternTable(object):
+    """Numbers distinct values in the order they are first added, so that
+    repeated values are stored once and referred to by their number"""
+    __slots__ = ('values', '_numbers')
+
+    def __init__(self):
+        self.values = []
+        self._numbers = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def number(self, value):
+        """Returns the number of a value, adding it if it is new"""
+        number = self._numbers.get(value)
+        if number is None:
+            number = self._numbers[value] = len(self.values)
+            self.values.append(value)
+        return number
+
+    def compact(self):
+        """Drops the lookup index once no more values will be added"""
+        self._numbers = None
+
+
+class CompactDiagram(object):
+    """What a render state remembers of a laid out diagram, in a fraction of
+    the memory of the seqdiag diagram: participants in an interned table,
+    and messages as arrays of participant and attribute numbers. The diagram
+    must have been measured by a drawer, as new_drawer() does."""
+    __slots__ = ('attributes', 'participants', 'styles', 'node_layout',
+                 'node_cosmetics', 'edge_ends', 'edge_layout',
+                 'edge_cosmetics', 'others')
+
+    def __init__(self, diagram):
+        self.attributes = _attributes(diagram, DIAGRAM_LAYOUT_ATTRIBUTES)
+        self.participants = InternTable()
+        ## distinct attribute tuples, shared by every element that has them
+        self.styles = InternTable()
+        self.node_layout = array('i')
+        self.node_cosmetics = array('i')
+        for node in diagram.nodes:
+            self.participants.number(node.id)
+            self.node_layout.append(self.styles.number(
+                _attributes(node, NODE_LAYOUT_ATTRIBUTES)))
+            self.node_cosmetics.append(self.styles.number(
+                _attributes(node, COSMETIC_ATTRIBUTES)))
+        self.edge_ends = array('i')
+        self.edge_layout = array('i')
+        self.edge_cosmetics = array('i')
+        for edge in diagram.edges:
+            self.edge_ends.append(self.participants.number(edge.node1.id))
+            self.edge_ends.append(self.participants.number(edge.node2.id))
+            self.edge_layout.append(self.styles.number(
+                _attributes(edge, EDGE_LAYOUT_ATTRIBUTES)))
+            self.edge_cosmetics.append(self.styles.number(
+                _attributes(edge, COSMETIC_ATTRIBUTES)))
+        self.others = tuple(
+            tuple(_attributes(element, OTHER_LAYOUT_ATTRIBUTES +
+                              COSMETIC_ATTRIBUTES) + _members(element)
+                  for element in getattr(diagram, name, []))
+            for name in ('groups', 'separators', 'altblocks'))
+        self.participants.compact()
+        self.styles.compact()
+
+    def _styles(self, numbers):
+        """Returns the attribute tuples of a sequence of style numbers"""
+        values = self.styles.values
+        return [values[number] for number in numbers]
+
+    def same_layout(self, other):
+        """Returns whether two diagrams are laid out the same"""
+        return (self.attributes == other.attributes and
+                self.participants.values == other.participants.values and
+                self.edge_ends == other.edge_ends and
+                self.others == other.others and
+                self._styles(self.node_layout) ==
+                other._styles(other.node_layout) and
+                self._styles(self.edge_layout) ==
+                other._styles(other.edge_layout))
+
+    def changes(self, other):
+        """Returns the indexes of the nodes and of the edges of two diagrams
+        laid out the same whose cosmetic attributes differ"""
+        return tuple(
+            [index for index, (mine, theirs) in enumerate(zip(
+                self._styles(numbers), other._styles(other_numbers)))
+             if mine != theirs]
+            for numbers, other_numbers in (
+                (self.node_cosmetics, other.node_cosmetics),
+                (self.edge_cosmetics, other.edge_cosmetics)))
+
+
+def _element_box(metrics, element):
+    """Returns the bounding box (x1, y1, x2, y2) of a node or an edge, or None
+    if the metrics cannot tell"""
+    try:
+        if hasattr(element, 'node1'):
+            edge = metrics.edge(element)
+            points = list(edge.shaft)
+            boxes = [edge.textbox]
+        else:
+            points = []
+            boxes = [metrics.cell(element).box]
+    except (AttributeError, KeyError, TypeError):
+        return None
+    for box in boxes:
+        points.extend([(box[0], box[1]), (box[2], box[3])])
+    if not points:
+        return None
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    margin = 4
+    return (min(xs) - margin, min(ys) - margin,
+            max(xs) + margin, max(ys) + margin)
+
+
+@serialized
+def changed_boxes(previous, diagram, current=None, drawer=None):
+    """Compares the compact model of a previous diagram with a diagram, whose
+    compact model is `current` if already built. Returns None if their
+    layouts differ, otherwise the list of bounding boxes of the elements
+    whose cosmetic attributes differ, which is empty if both diagrams look
+    the same. The diagram and the boxes are measured by `drawer`, the
+    drawer of the diagram if one was already made."""
+    if current is None:
+        drawer = drawer or new_drawer(diagram)
+        current = CompactDiagram(diagram)
+    if previous is None or not previous.same_layout(current):
+        return None
+    metrics = None
+    boxes = []
+    nodes, edges = previous.changes(current)
+    for new in [diagram.nodes[index] for index in nodes] + \
+            [diagram.edges[index] for index in edges]:
+        if metrics is None:
+            metrics = (drawer or new_drawer(diagram)).metrics
+            ## antialiased drawers scale their metrics up, but the raster
+            ## is reduced back to the size of the diagram
+            metrics = getattr(metrics, 'subject', metrics)
+        box = _element_box(metrics, new)
+        if box is None:
+            return None
+        boxes.append(box)
+    return boxes
+
+
+class RenderState(object):
+    """Remembers the last diagram rendered for an editor, so that an edit
+    that leaves the layout untouched does not replace the whole image"""
+
+    def __init__(self, cache=CACHE):
+        self.cache = cache
+        ## the CompactDiagram of the last render
+        self.model = None
+        self.raster = None
+        ## whether repeated runs of messages are folded
+        self.collapse = False
+        ## whether broken statements are left out instead of failing
+        self.recover = False
+        ## the ParseErrors of the last text rendered
+        self.errors = []
+
+    @serialized
+    def render(self, text, preview=None):
+        """Renders a text. Returns the raster and the list of boxes that
+        changed since the previous render, or None for the boxes when the
+        whole image changed. Returns (None, None) if the text is not a valid
+        diagram; its errors are left in `errors` either way.
+
+        When a large diagram is drawn from scratch, `preview`, if given, is
+        first called with a sketch of it and its scale; the render stops,
+        returning (None, None), if that call returns False."""
+        errors = []
+        diagram = text2diagram(text, self.collapse, errors, self.recover)
+        self.errors = errors
+        if diagram is None:
+            return None, None
+        ## made once, to measure the labels the layout depends on and the
+        ## changed boxes, and to draw
+        drawer = new_drawer(diagram)
+        model = CompactDiagram(diagram)
+        if self.raster is None:
+            boxes = None
+        else:
+            boxes = changed_boxes(self.model, diagram, model, drawer)
+        if boxes == []:
+            self.model = model
+            return self.raster, boxes
+        ## only renders that skipped statements differ from strict ones
+        key = render_key(text, self.collapse, bool(errors))
+        raster = self.cache.get(key)
+        if raster is None and preview is not None and boxes is None and \
+                len(diagram.edges) >= PREVIEW_MIN_EDGES:
+            try:
+                sketch = diagram2preview(diagram)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                sketch = None
+            if sketch is not None and preview(*sketch) is False:
+                return None, None
+        if raster is None:
+            if BANDS > 1 and len(diagram.edges) >= BAND_MIN_EDGES:
+                raster = text2raster_bands(text, BANDS, self.collapse,
+                                           recover=self.recover)
+            else:
+                raster = diagram2raster(diagram, drawer)
+            self.cache.put(key, raster)
+        self.model = model
+        self.raster = raster
+        return raster, boxes
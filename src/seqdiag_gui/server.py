@@ -0,0 +1,282 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    server.py
+Author:
+    Luis Osa <logc>
+Description:
+    A local render server. It keeps a pool of worker processes that have
+    already imported seqdiag and loaded their fonts, and serves render
+    requests over HTTP on localhost or on a Unix socket. Every client shares
+    the server's render cache. This module does not import wx.
+
+    Requests are POSTed to /render as a JSON object with a list of `sources`
+    and an optional `encoding`, either "rgba" (the default) or "png". The
+    response holds one result per source, in order: null for sources that
+    are not valid diagrams, otherwise an object with the `width`, `height`
+    and base64 `data` of the image. GET /stats describes the cache.
+"""
+import argparse
+import base64
+import httplib
+import json
+import multiprocessing
+import os
+import socket
+import sys
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from collections import OrderedDict
+
+import seqdiagrams
+from cache import RenderCache
+
+DEFAULT_PORT = 8750
+UNIX_PREFIX = 'unix:'
+
+
+def _warm_up():
+    """Initializes a pool process by importing seqdiag and loading fonts"""
+    seqdiagrams.load()
+
+
+def _render(text):
+    """Renders a text into a raster inside a pool process"""
+    diagram = seqdiagrams.text2diagram(text)
+    if diagram is None:
+        return None
+    return seqdiagrams.diagram2raster(diagram)
+
+
+class RenderServer(object):
+    """Renders batches of diagram sources on a pool of warm processes, going
+    through a cache shared by every client"""
+
+    def __init__(self, processes=None, cache=None):
+        self.cache = cache or seqdiagrams.CACHE
+        self.pool = multiprocessing.Pool(processes, initializer=_warm_up)
+
+    def render_many(self, texts):
+        """Returns the rasters of a batch of texts, None for invalid ones.
+        Texts that appear several times in a batch are rendered once."""
+        keys = [seqdiagrams.render_key(text) for text in texts]
+        results = {}
+        missing = OrderedDict()
+        for key, text in zip(keys, texts):
+            raster = self.cache.get(key)
+            if raster is None:
+                missing.setdefault(key, text)
+            else:
+                results[key] = raster
+        if missing:
+            rendered = self.pool.map(_render, missing.values())
+            for key, raster in zip(missing.keys(), rendered):
+                if raster is not None:
+                    self.cache.put(key, raster)
+                results[key] = raster
+        return [results[key] for key in keys]
+
+    def close(self):
+        """Stops the worker processes"""
+        self.pool.terminate()
+        self.pool.join()
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """Answers the HTTP requests of render clients"""
+
+    def log_message(self, format, *args):
+        """Logs a request; Unix socket clients have no address to report"""
+        if isinstance(self.client_address, tuple):
+            client = self.client_address[0]
+        else:
+            client = UNIX_PREFIX + str(self.server.server_address)
+        sys.stderr.write('{0} - [{1}] {2}\n'.format(
+            client, self.log_date_time_string(), format % args))
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_error(404)
+            return
+        cache = self.server.renderer.cache
+        self.send_json({'entries': len(cache), 'bytes': cache.current_bytes,
+                        'hits': cache.hits, 'misses': cache.misses})
+
+    def do_POST(self):
+        if self.path != '/render':
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.getheader('content-length', 0))
+            request = json.loads(self.rfile.read(length))
+            sources = request['sources']
+            encoding = request.get('encoding', 'rgba')
+        except (ValueError, KeyError, TypeError):
+            self.send_error(400, 'Expected a JSON object with sources')
+            return
+        rasters = self.server.renderer.render_many(sources)
+        self.send_json({'results': [encode_raster(raster, encoding)
+                                    for raster in rasters]})
+
+    def send_json(self, value):
+        """Sends a JSON response"""
+        body = json.dumps(value)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server answering each request on its own thread"""
+    daemon_threads = True
+
+
+class ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+    """A Unix socket server answering each request on its own thread"""
+    daemon_threads = True
+
+
+def encode_raster(raster, encoding='rgba'):
+    """Turns a raster into a JSON-friendly value"""
+    if raster is None:
+        return None
+    if encoding == 'png':
+        data = seqdiagrams.raster2png(raster)
+    else:
+        data = raster.data
+    return {'width': raster.width, 'height': raster.height,
+            'data': base64.b64encode(data)}
+
+
+def decode_raster(value):
+    """Turns a value built by encode_raster back into a raster"""
+    if value is None:
+        return None
+    return seqdiagrams.Raster(value['width'], value['height'],
+                              base64.b64decode(value['data']))
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """An HTTP connection over a Unix socket"""
+
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class RenderServerError(IOError):
+    """Raised by a render client that got no valid answer from the server"""
+
+
+class RenderClient(object):
+    """Sends render requests to a render server. The address is either
+    `host:port` or `unix:/path/to/socket`."""
+
+    def __init__(self, address):
+        self.address = address
+
+    def render(self, text):
+        """Returns the raster of a text, or None if it is not a valid
+        diagram. Raises RenderServerError if the server cannot be reached or
+        does not answer as expected."""
+        return self.render_many([text])[0]
+
+    def render_many(self, texts):
+        """Returns the rasters of a batch of texts"""
+        response = self._post('/render', {'sources': list(texts)})
+        return [decode_raster(value) for value in response['results']]
+
+    def _connection(self):
+        """Opens a connection to the server"""
+        if self.address.startswith(UNIX_PREFIX):
+            return UnixHTTPConnection(self.address[len(UNIX_PREFIX):])
+        return httplib.HTTPConnection(self.address)
+
+    def _post(self, path, value):
+        """POSTs a JSON value and returns the JSON response"""
+        connection = self._connection()
+        try:
+            connection.request('POST', path, json.dumps(value),
+                               {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise RenderServerError(
+                    'render server answered {0} {1}'.format(
+                        response.status, response.reason))
+            return json.loads(body)
+        except RenderServerError:
+            raise
+        except (EnvironmentError, httplib.HTTPException, ValueError) as error:
+            raise RenderServerError('no answer from the render server at '
+                                    '{0}: {1}'.format(self.address, error))
+        finally:
+            connection.close()
+
+
+def build_parser():
+    """Builds the command line parser of the render server"""
+    parser = argparse.ArgumentParser(
+        prog='seqdiag_gui-server',
+        description='Serve diagram renders from a pool of warm workers.')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+                        help='localhost port to listen on')
+    parser.add_argument('-s', '--socket', default=None,
+                        help='listen on this Unix socket instead')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of render processes (default: CPUs)')
+    parser.add_argument('--cache-dir', default=seqdiagrams.CACHE_DIR,
+                        help='keep rendered diagrams in this directory')
+    return parser
+
+
+def run(argv=None):
+    """Render server entry point"""
+    options = build_parser().parse_args(argv)
+    cache = RenderCache(seqdiagrams.CACHE_MAX_BYTES, options.cache_dir,
+                        sizeof=lambda raster: len(raster.data),
+                        max_disk_bytes=seqdiagrams.CACHE_MAX_DISK_BYTES)
+    renderer = RenderServer(options.workers, cache)
+    if options.socket:
+        if os.path.exists(options.socket):
+            os.remove(options.socket)
+        server = ThreadingUnixServer(options.socket, RenderRequestHandler)
+        print 'Serving renders on {0}{1}'.format(UNIX_PREFIX, options.socket)
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', options.port),
+                                     RenderRequestHandler)
+        print 'Serving renders on 127.0.0.1:{0}'.format(options.port)
+    server.renderer = renderer
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        renderer.close()
+        if options.socket and os.path.exists(options.socket):
+            os.remove(options.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,62 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    test_cache.py
+Author:
+    Luis Osa <logc>
+Description:
+    Tests of the disk tier of the render cache.
+"""
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+
+from seqdiag_gui.cache import RenderCache
+
+
+class DiskTierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_files_used_longest_ago_are_evicted(self):
+        cache = RenderCache(max_bytes=0, directory=self.directory,
+                            max_disk_bytes=2500)
+        for index, key in enumerate(('a', 'b', 'c')):
+            cache.put(key, 'x' * 1000)
+            os.utime(cache._path(key), (index, index))
+        self.assertEqual(self.files(), ['b.cache', 'c.cache'])
+        cache.get('b')
+        cache.put('d', 'x' * 1000)
+        self.assertEqual(self.files(), ['b.cache', 'd.cache'])
+
+    def test_failed_write_leaves_no_file(self):
+        cache = RenderCache(directory=self.directory, sizeof=lambda value: 0)
+        with self.assertRaises(cPickle.PicklingError):
+            cache.put('a', lambda: None)
+        self.assertEqual(self.files(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    test_journal.py
+Author:
+    Luis Osa <logc>
+Description:
+    Tests of saving sources by their changed tail.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from seqdiag_gui.journal import (JOURNAL_EXTENSION, LOCK_EXTENSION,
+                                 QUARANTINE_DIR, fcntl, recover,
+                                 remove_journal, write_changes)
+
+SAVED = u'seqdiag {\n  A -> B;\n}\n'
+
+
+class WriteChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'source.diag')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text):
+        with open(self.path, 'wb') as source:
+            source.write(text.encode('utf-8'))
+
+    def read(self):
+        with open(self.path, 'rb') as source:
+            return source.read().decode('utf-8')
+
+    def test_only_the_tail_is_written(self):
+        self.write(SAVED)
+        text = SAVED.replace('}', '  B -> C;\n}')
+        self.assertEqual(write_changes(self.path, SAVED, text),
+                         len(text) - SAVED.index('}'))
+        self.assertEqual(self.read(), text)
+
+    def test_file_edited_elsewhere_is_rewritten(self):
+        ## the same size as the saved text, but a different start
+        self.write(SAVED.replace('A', 'X'))
+        text = SAVED.replace('}', '  B -> C;\n}')
+        self.assertEqual(write_changes(self.path, SAVED, text), len(text))
+        self.assertEqual(self.read(), text)
+
+
+class RecoverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, *lines):
+        with open(os.path.join(self.directory, name), 'wb') as journal:
+            journal.writelines(line + '\n' for line in lines)
+        return os.path.join(self.directory, name)
+
+    def locked_elsewhere(self, path):
+        """Returns whether another process could not lock a journal"""
+        with open(path + LOCK_EXTENSION, 'ab') as lockfile:
+            try:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return True
+            return False
+
+    def test_unreplayable_journal_is_quarantined(self):
+        name = 'broken' + JOURNAL_EXTENSION
+        self.write(name, '{"op": "delta", "start": 0, "end": 0}')
+        self.assertEqual(recover(self.directory), [])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, name)))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, QUARANTINE_DIR, name)))
+
+    @unittest.skipIf(fcntl is None, 'journals are not locked here')
+    def test_recovered_journal_is_locked(self):
+        path = self.write('edited' + JOURNAL_EXTENSION, '{"op": "open"}',
+                          '{"op": "snapshot", "text": "seqdiag {}"}')
+        [(recovered, _, _, text)] = recover(self.directory)
+        self.assertEqual((recovered, text), (path, u'seqdiag {}'))
+        self.assertTrue(self.locked_elsewhere(path))
+        remove_journal(path)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @unittest.skipIf(fcntl is None, 'journals are not locked here')
+    def test_journal_locked_by_another_process_is_left_alone(self):
+        path = self.write('live' + JOURNAL_EXTENSION,
+                          '{"op": "delta", "start": 0, "end": 0}')
+        with open(path + LOCK_EXTENSION, 'ab') as lockfile:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            self.assertEqual(recover(self.directory), [])
+        self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    test_loading.py
+Author:
+    Luis Osa <logc>
+Description:
+    Tests of reading sources chunk by chunk.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from seqdiag_gui.loading import SNIFF_SIZE, DocumentLoader, LoadError
+
+
+class DocumentLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'source.diag')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, data, chunk_size=1024):
+        with open(self.path, 'wb') as source:
+            source.write(data)
+        loader = DocumentLoader(self.path, chunk_size)
+        chunks = []
+        while not loader.done:
+            chunk = loader.step()
+            if chunk is not None:
+                chunks.append(chunk)
+        return loader, u''.join(chunks)
+
+    def test_characters_split_between_chunks_are_decoded(self):
+        text = u'seqdiag { A -> B [label = "\xe9t\xe9"]; }\n' * 100
+        loader, loaded = self.load(text.encode('utf-8'), chunk_size=7)
+        self.assertEqual(loader.encoding, 'utf-8')
+        self.assertEqual(loaded, text)
+
+    def test_undecodable_tail_is_reported(self):
+        head = 'seqdiag { A -> B; }\n' * (SNIFF_SIZE // 20 + 1)
+        with self.assertRaises(LoadError) as raised:
+            self.load(head + '# caf\xe9\n')
+        self.assertEqual(raised.exception.encoding, 'utf-8')
+        self.assertEqual(raised.exception.offset, len(head) + 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
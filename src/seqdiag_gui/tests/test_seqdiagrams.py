@@ -0,0 +1,173 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    test_seqdiagrams.py
+Author:
+    Luis Osa <logc>
+Description:
+    Tests of rendering diagram sources into rasters.
+"""
+import threading
+import unittest
+
+from seqdiag_gui import seqdiagrams
+from seqdiag_gui.cache import RenderCache
+
+SOURCE = u'''seqdiag {
+  browser -> server [label = "GET /index"];
+  server -> database [label = "query"];
+  server <-- database;
+  browser <-- server;
+}'''
+## sets the default colours kept on seqdiag's element classes
+COLOURED = SOURCE.replace('seqdiag {', u'''seqdiag {
+  default_linecolor = red;
+  default_node_color = yellow;''')
+
+
+def render_state():
+    """Returns a RenderState with a cache of its own"""
+    return seqdiagrams.RenderState(
+        RenderCache(sizeof=lambda raster: len(raster.data)))
+
+
+class RenderStateTest(unittest.TestCase):
+
+    def test_cosmetic_edit_reports_changed_boxes(self):
+        state = render_state()
+        raster, boxes = state.render(SOURCE)
+        self.assertIsNotNone(raster)
+        self.assertIsNone(boxes)
+        edited = SOURCE.replace('label = "query"',
+                                'label = "query", color = red')
+        raster, boxes = state.render(edited)
+        self.assertIsNotNone(raster)
+        self.assertEqual(len(boxes), 1)
+        x1, y1, x2, y2 = boxes[0]
+        self.assertTrue(0 <= x1 < x2 <= raster.width)
+        self.assertTrue(0 <= y1 < y2 <= raster.height)
+
+    def test_unchanged_text_changes_no_boxes(self):
+        state = render_state()
+        first, _ = state.render(SOURCE)
+        raster, boxes = state.render(SOURCE)
+        self.assertIs(raster, first)
+        self.assertEqual(boxes, [])
+
+    def test_cosmetic_edit_in_a_group_reports_changed_boxes(self):
+        state = render_state()
+        grouped = SOURCE.replace('seqdiag {', 'seqdiag {\n  group { A; B; }')
+        state.render(grouped)
+        raster, boxes = state.render(grouped.replace(
+            'label = "query"', 'label = "query", color = red'))
+        self.assertEqual(len(boxes), 1)
+
+    def test_label_wrapped_on_more_lines_changes_the_layout(self):
+        state = render_state()
+        state.render(SOURCE)
+        ## one line, which the drawer wraps to the space between its ends
+        label = ' '.join(['query'] * 20)
+        raster, boxes = state.render(SOURCE.replace(
+            'label = "query"', 'label = "{0}"'.format(label)))
+        self.assertIsNotNone(raster)
+        self.assertIsNone(boxes)
+
+    def test_syntax_error_is_located(self):
+        state = render_state()
+        broken = SOURCE.replace('server -> database', 'server ->')
+        self.assertEqual(state.render(broken), (None, None))
+        [error] = state.errors
+        self.assertEqual((error.line, error.column), (3, 13))
+        self.assertEqual(error.message, "got unexpected token: Op '['")
+
+    def test_recovered_render_is_not_reused_for_strict_renders(self):
+        state = render_state()
+        state.recover = True
+        broken = SOURCE.replace('server -> database', 'server ->')
+        raster, _ = state.render(broken)
+        self.assertIsNotNone(raster)
+        self.assertEqual(len(state.errors), 1)
+        self.assertIsNone(seqdiagrams.text2raster(broken, state.cache))
+
+    def test_large_diagram_is_previewed(self):
+        messages = [u'  A{0} -> B{1} [label = "m{2}"];'.format(
+            number % 3, number % 5, number)
+            for number in range(seqdiagrams.PREVIEW_MIN_EDGES)]
+        text = u'seqdiag {\n' + u'\n'.join(messages) + u'\n}'
+        sketches = []
+
+        def preview(*sketch):
+            sketches.append(sketch)
+            ## stops the render, which takes long at this size
+            return False
+        self.assertEqual(render_state().render(text, preview), (None, None))
+        self.assertEqual(len(sketches), 1)
+        sketch, scale = sketches[0]
+        self.assertTrue(0 < scale <= 1)
+        self.assertEqual(len(sketch.data), sketch.width * sketch.height * 4)
+
+
+class BandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.antialias = seqdiagrams.ANTIALIAS
+
+    def tearDown(self):
+        seqdiagrams.ANTIALIAS = self.antialias
+
+    def assert_bands_match(self, text, bands):
+        full = seqdiagrams.diagram2raster(seqdiagrams.text2diagram(text))
+        results = [seqdiagrams.draw_band((text, False, False, band, bands))
+                   for band in range(bands)]
+        for width, height, _ in results:
+            self.assertEqual((width, height), (full.width, full.height))
+        self.assertTrue(''.join(data for _, _, data in results) ==
+                        full.data)
+
+    def test_bands_match_full_raster(self):
+        seqdiagrams.ANTIALIAS = False
+        self.assert_bands_match(SOURCE, 3)
+
+    def test_antialiased_bands_match_full_raster(self):
+        seqdiagrams.ANTIALIAS = True
+        self.assert_bands_match(SOURCE, 3)
+
+
+class ThreadTest(unittest.TestCase):
+
+    def test_threads_render_as_one_thread_does(self):
+        texts = [SOURCE, COLOURED]
+        expected = [seqdiagrams.text2raster(text, RenderCache())
+                    for text in texts]
+        rasters = [[], []]
+
+        def render(index):
+            for _ in range(10):
+                rasters[index].append(
+                    seqdiagrams.text2raster(texts[index], RenderCache()))
+        threads = [threading.Thread(target=render, args=(index,))
+                   for index in range(len(texts))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for raster, results in zip(expected, rasters):
+            self.assertEqual(len(results), 10)
+            self.assertTrue(all(result == raster for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    test_traces.py
+Author:
+    Luis Osa <logc>
+Description:
+    Tests of writing trace events as diagram sources.
+"""
+import unittest
+
+from seqdiag_gui import seqdiagrams
+from seqdiag_gui.traces import TraceEvent, statement, window_text
+
+
+class StatementTest(unittest.TestCase):
+
+    def diagram(self, *events):
+        text = window_text([statement(event) for event in events])
+        diagram = seqdiagrams.text2diagram(text)
+        self.assertIsNotNone(diagram)
+        return diagram
+
+    def test_quotes_and_backslashes_keep_labels_whole(self):
+        diagram = self.diagram(
+            TraceEvent(0.0, u'client', u'server', u'GET "C:\\"', False),
+            TraceEvent(1.0, u'server', u'client', u'done', True))
+        self.assertEqual([edge.label for edge in diagram.edges],
+                         [u"GET 'C:/'", u'done'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    traces.py
+Author:
+    Luis Osa <logc>
+Description:
+    Imports request traces as sequence diagrams. Traces are read as a stream
+    of JSON lines, one message per line, and split into windows of a bounded
+    number of messages or time span. Every window is written as a diagram
+    source of its own, next to an index of the windows, so that only one
+    window is held in memory and the windows can be rendered in parallel.
+    This module does not depend on wx.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import namedtuple
+
+from batch import output_path, render_file
+
+WINDOW_MESSAGES = 500
+INDEX_FILE = 'index.json'
+WINDOW_FILE = 'window-{0:05d}.diag'
+## accepted names of every field of a trace event, in order of preference
+FIELDS = {'timestamp': ('timestamp', 'ts', 'time'),
+          'source': ('from', 'source', 'caller'),
+          'target': ('to', 'target', 'callee'),
+          'label': ('label', 'name', 'operation')}
+REPLY_KINDS = ('return', 'reply', 'response')
+
+TraceEvent = namedtuple('TraceEvent', 'timestamp source target label reply')
+Window = namedtuple('Window', 'number first_line start end statements')
+
+
+def _field(record, name):
+    """Returns the first present alternative of a field of a record"""
+    for key in FIELDS[name]:
+        if key in record:
+            return record[key]
+    return None
+
+
+def parse_event(line):
+    """Returns the trace event on a JSON line, or None if the line does not
+    hold a message between two participants"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    source, target = _field(record, 'source'), _field(record, 'target')
+    if not source or not target:
+        return None
+    try:
+        timestamp = float(_field(record, 'timestamp') or 0.0)
+    except (TypeError, ValueError):
+        return None
+    label = _field(record, 'label')
+    reply = record.get('kind', record.get('type')) in REPLY_KINDS
+    return TraceEvent(timestamp, unicode(source), unicode(target),
+                      unicode(label) if label is not None else None, reply)
+
+
+def quote(text):
+    """Quotes a name or label for a seqdiag source. The seqdiag tokenizer
+    does not end a string at a quote that follows a backslash, and has no
+    escape for a backslash itself, so double quotes become single ones and
+    backslashes forward slashes."""
+    return u'"{0}"'.format(text.replace('"', "'").replace('\\', '/'))
+
+
+def statement(event):
+    """Returns the seqdiag statement of a trace event"""
+    arrow = u'-->' if event.reply else u'->'
+    line = u'{0} {1} {2}'.format(quote(event.source), arrow,
+                                 quote(event.target))
+    if event.label:
+        line += u' [label = {0}]'.format(quote(event.label))
+    return line + u';'
+
+
+def window_text(statements):
+    """Returns the diagram source of a window"""
+    return u'diagram {{\n{0}}}\n'.format(
+        u''.join(u'  {0}\n'.format(line) for line in statements))
+
+
+def iter_windows(lines, max_messages=WINDOW_MESSAGES, max_seconds=None):
+    """Yields the windows of a stream of JSON lines. A window closes once it
+    holds `max_messages` messages or, if given, once a message arrives
+    `max_seconds` or more after its first one. Lines that are not messages
+    are skipped."""
+    number, statements = 0, []
+    first_line = start = end = None
+    for line_number, line in enumerate(lines, 1):
+        event = parse_event(line)
+        if event is None:
+            continue
+        if statements and max_seconds is not None and \
+                event.timestamp - start >= max_seconds:
+            yield Window(number, first_line, start, end, statements)
+            number, statements = number + 1, []
+        if not statements:
+            first_line, start = line_number, event.timestamp
+        statements.append(statement(event))
+        end = event.timestamp
+        if len(statements) >= max_messages:
+            yield Window(number, first_line, start, end, statements)
+            number, statements = number + 1, []
+    if statements:
+        yield Window(number, first_line, start, end, statements)
+
+
+def import_trace(path, output_dir, max_messages=WINDOW_MESSAGES,
+                 max_seconds=None, progress=None):
+    """Splits the trace at `path` into window sources under `output_dir`,
+    writes their index there and returns it. `progress`, if given, is called
+    with the number of windows written so far."""
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    windows = []
+    with open(path, 'r') as trace:
+        for window in iter_windows(trace, max_messages, max_seconds):
+            filename = WINDOW_FILE.format(window.number)
+            with io.open(os.path.join(output_dir, filename), 'w',
+                         encoding='utf-8') as source:
+                source.write(window_text(window.statements))
+            windows.append({'number': window.number, 'path': filename,
+                            'first_line': window.first_line,
+                            'start': window.start, 'end': window.end,
+                            'messages': len(window.statements)})
+            if progress is not None:
+                progress(len(windows))
+    index = {'trace': os.path.abspath(path), 'max_messages': max_messages,
+             'max_seconds': max_seconds, 'windows': windows}
+    with open(os.path.join(output_dir, INDEX_FILE), 'w') as output:
+        json.dump(index, output, indent=2)
+    return index
+
+
+def load_index(output_dir):
+    """Reads the index of an imported trace"""
+    with open(os.path.join(output_dir, INDEX_FILE), 'r') as index:
+        return json.load(index)
+
+
+def window_path(output_dir, index, number):
+    """Returns the path of the source of a window"""
+    return os.path.join(output_dir, index['windows'][number]['path'])
+
+
+def render_windows(output_dir, jobs=None):
+    """Renders every window of an imported trace on a pool of processes and
+    yields, as they finish, the source, elapsed time and error of each one"""
+    index = load_index(output_dir)
+    work = []
+    for number in range(len(index['windows'])):
+        source = window_path(output_dir, index, number)
+        work.append((source, output_path(source, output_dir)))
+    pool = multiprocessing.Pool(max(1, jobs or multiprocessing.cpu_count()))
+    try:
+        for result in pool.imap_unordered(render_file, work):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def build_parser():
+    """Builds the command line parser of the trace importer"""
+    parser = argparse.ArgumentParser(
+        prog='seqdiag_gui-import',
+        description='Split a JSON lines trace into sequence diagrams.')
+    parser.add_argument('trace', help='trace file, one JSON message per line')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='directory for the windows (default: next to '
+                        'the trace, named after it)')
+    parser.add_argument('-m', '--messages', type=int, default=WINDOW_MESSAGES,
+                        help='most messages in a window')
+    parser.add_argument('-s', '--seconds', type=float, default=None,
+                        help='longest time span of a window')
+    parser.add_argument('-r', '--render', action='store_true',
+                        help='render the windows once imported')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of rendering processes')
+    return parser
+
+
+def default_output_dir(path):
+    """Returns the directory the windows of a trace are written to unless
+    told otherwise"""
+    return os.path.splitext(path)[0] + '.windows'
+
+
+def run(argv=None):
+    """Trace importer entry point"""
+    options = build_parser().parse_args(argv)
+    output_dir = options.output_dir or default_output_dir(options.trace)
+    start = time.time()
+    index = import_trace(options.trace, output_dir, max(1, options.messages),
+                         options.seconds)
+    print '{0} windows written to {1} in {2:.3f}s'.format(
+        len(index['windows']), output_dir, time.time() - start)
+    if not options.render:
+        return 0
+    failures = 0
+    for source, elapsed, error in render_windows(output_dir, options.jobs):
+        if error is not None:
+            failures += 1
+            print '{0:8.3f}s  {1}  FAILED: {2}'.format(elapsed, source, error)
+    print '{0} rendered, {1} failed in {2:.3f}s'.format(
+        len(index['windows']) - failures, failures, time.time() - start)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
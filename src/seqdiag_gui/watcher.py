@@ -0,0 +1,268 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    watcher.py
+Author:
+    Luis Osa <logc>
+Description:
+    Watches diagram sources for changes made outside the application. Linux
+    inotify is used through ctypes where it is available; elsewhere the
+    watched directories are polled and their files compared by stat. Bursts
+    of changes, such as an editor saving through a temporary file, are
+    reported together once they settle. This module does not depend on wx.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from batch import SOURCE_EXTENSION
+
+## changes are reported once no other change arrived for this long
+COALESCE_SECONDS = 0.2
+POLL_SECONDS = 1.0
+## how often the watcher thread checks whether it was stopped
+IDLE_SECONDS = 0.5
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyBackend(object):
+    """Reports the files that changed in a set of directories through Linux
+    inotify. Raises OSError if inotify is not available."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._directories = {}
+
+    def add_directory(self, directory):
+        """Starts watching a directory"""
+        encoded = directory
+        if isinstance(encoded, unicode):
+            encoded = encoded.encode(sys.getfilesystemencoding())
+        wd = self._add_watch(self.fd, encoded, WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'cannot watch ' + encoded)
+        self._directories[wd] = directory
+
+    def remove_directory(self, directory):
+        """Stops watching a directory"""
+        for wd, watched in self._directories.items():
+            if watched == directory:
+                self._rm_watch(self.fd, wd)
+                del self._directories[wd]
+
+    def wait(self, timeout):
+        """Waits up to `timeout` seconds for changes and returns the paths
+        that changed. Every watched directory is rescanned if the kernel
+        dropped events."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as error:
+            if error.errno == errno.EAGAIN:
+                return []
+            raise
+        changed = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                for directory in self._directories.values():
+                    changed.extend(_list_sources(directory))
+                continue
+            directory = self._directories.get(wd)
+            if directory is None or not name:
+                continue
+            if isinstance(directory, unicode):
+                name = name.decode(sys.getfilesystemencoding(), 'replace')
+            changed.append(os.path.join(directory, name))
+        return changed
+
+    def close(self):
+        """Releases the inotify descriptor"""
+        os.close(self.fd)
+
+
+def _list_sources(directory):
+    """Returns the paths of the files in a directory"""
+    try:
+        return [os.path.join(directory, name)
+                for name in os.listdir(directory)]
+    except OSError:
+        return []
+
+
+def _signature(path):
+    """Returns what a stat of a file says about its contents, or None if it
+    does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+class PollingBackend(object):
+    """Reports the files that changed in a set of directories by comparing
+    the stat of their files every `interval` seconds"""
+
+    def __init__(self, interval=POLL_SECONDS):
+        self.interval = interval
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def _snapshot(self, directory):
+        """Returns the stat signature of every file in a directory"""
+        return dict((path, _signature(path))
+                    for path in _list_sources(directory))
+
+    def add_directory(self, directory):
+        """Starts watching a directory"""
+        snapshot = self._snapshot(directory)
+        with self._lock:
+            self._snapshots[directory] = snapshot
+
+    def remove_directory(self, directory):
+        """Stops watching a directory"""
+        with self._lock:
+            self._snapshots.pop(directory, None)
+
+    def wait(self, timeout):
+        """Waits up to `timeout` seconds and returns the paths that changed"""
+        time.sleep(min(timeout, self.interval))
+        with self._lock:
+            directories = self._snapshots.keys()
+        changed = []
+        for directory in directories:
+            snapshot = self._snapshot(directory)
+            with self._lock:
+                previous = self._snapshots.get(directory)
+                if previous is None:
+                    continue
+                self._snapshots[directory] = snapshot
+            for path in set(snapshot) | set(previous):
+                if snapshot.get(path) != previous.get(path):
+                    changed.append(path)
+        return changed
+
+    def close(self):
+        """Nothing to release"""
+
+
+def create_backend():
+    """Returns the inotify backend where it is available, and the polling
+    backend otherwise"""
+    try:
+        return InotifyBackend()
+    except (OSError, AttributeError):
+        return PollingBackend()
+
+
+class Watcher(threading.Thread):
+    """Watches files, and directories for the diagram sources in them, on a
+    background thread. `callback` is called on that thread with the sorted
+    list of paths that changed, once changes stop arriving for `coalesce`
+    seconds."""
+
+    def __init__(self, callback, backend=None, coalesce=COALESCE_SECONDS):
+        super(Watcher, self).__init__(name='Watcher')
+        self.daemon = True
+        self.callback = callback
+        self.backend = backend or create_backend()
+        self.coalesce = coalesce
+        self.files = set()
+        self.directories = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _parents(self):
+        """Returns the directories the backend must watch"""
+        return self.directories | set(os.path.dirname(path)
+                                      for path in self.files)
+
+    def add(self, path):
+        """Starts watching a file, or the diagram sources in a directory"""
+        path = os.path.abspath(path)
+        with self._lock:
+            before = self._parents()
+            if os.path.isdir(path):
+                self.directories.add(path)
+            else:
+                self.files.add(path)
+            for directory in self._parents() - before:
+                self.backend.add_directory(directory)
+
+    def remove(self, path):
+        """Stops watching a file or a directory"""
+        path = os.path.abspath(path)
+        with self._lock:
+            before = self._parents()
+            self.files.discard(path)
+            self.directories.discard(path)
+            for directory in before - self._parents():
+                self.backend.remove_directory(directory)
+
+    def wanted(self, path):
+        """Returns whether a change to `path` is to be reported"""
+        with self._lock:
+            return path in self.files or (
+                path.endswith(SOURCE_EXTENSION) and
+                os.path.dirname(path) in self.directories)
+
+    def stop(self):
+        """Asks the watcher thread to finish"""
+        self._stopped.set()
+
+    def run(self):
+        pending, last_change = set(), None
+        while not self._stopped.is_set():
+            timeout = self.coalesce if pending else IDLE_SECONDS
+            changed = [path for path in self.backend.wait(timeout)
+                       if self.wanted(path)]
+            if changed:
+                pending.update(changed)
+                last_change = time.time()
+            elif pending and time.time() - last_change >= self.coalesce:
+                self.callback(sorted(pending))
+                pending = set()
+        self.backend.close()
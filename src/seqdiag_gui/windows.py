@@ -12,12 +12,10 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import cStringIO
-
 import wx
 import wx.html
 
-import seqdiagrams
+from canvas import TiledCanvas
 
 HELP_PAGE = "var/resources/doc/help_page.html"
 START_DIAG = """diagram {
@@ -29,20 +27,53 @@ START_DIAG = """diagram {
   browser <-- webserver;
 }
 """
+PLACEHOLDER_SIZE = (640, 320)
+
+
+class DocumentPanel(wx.Panel):
+    """
+    A DocumentPanel shows one open document: an upper part where the result of
+    evaluating its text with seqdiag is presented, and a lower part where the
+    user can type the text.
+    """
+
+    def __init__(self, parent, document, text=START_DIAG):
+        super(DocumentPanel, self).__init__(parent, -1)
+        self.document = document
+        ## the diagram is rendered in the background once the panel shows
+        self.img = TiledCanvas(self, size=PLACEHOLDER_SIZE)
+        ## rich text, so that lines with syntax errors can be marked
+        self.control = wx.TextCtrl(
+            self, -1, text, style=wx.TE_MULTILINE | wx.TE_RICH2 | wx.EXPAND)
+        ## the ranges of the text marked as holding syntax errors
+        self.error_ranges = []
+        text_proportion = 1
+        image_proportion = 1
+        box = wx.BoxSizer(wx.VERTICAL)
+        box.Add(self.img, image_proportion, wx.EXPAND)
+        box.Add(self.control, text_proportion, wx.EXPAND | wx.ALL, 10)
+        self.SetSizer(box)
+
+    def _get_raster(self):
+        return self.document.render_state.raster
+
+    def _set_raster(self, raster):
+        self.document.render_state.raster = raster
+
+    raster = property(_get_raster, _set_raster,
+                      doc='The raster shown for the document, if any')
 
 
 class MainWindow(wx.Frame):
     """
-    The MainWindow consists of two parts: a lower part where the user can type
-    a text, and an upper part where the result of evaluating this text with
-    seqdiag is presented. The menu allows to save the result as a graph file.
+    The MainWindow holds a tab for every open document, each one consisting of
+    two parts: a lower part where the user can type a text, and an upper part
+    where the result of evaluating this text with seqdiag is presented. The
+    menu allows to save the result as a graph file.
     """
 
-    def __init__(self, filename='simple.diag', imgfile='simple.png'):
+    def __init__(self):
         super(MainWindow, self).__init__(None, size=wx.DefaultSize)
-        self.filename = filename
-        self.imgfile = imgfile
-        self.dirname = '.'
         self.height = 0
         self.width = 0
 
@@ -50,48 +81,76 @@ class MainWindow(wx.Frame):
         self.status_bar = None
         self.save_button = None
         self.eval_button = None
-        self.control = None
-        self.img = None
+        self.live_preview = None
+        self.notebook = None
         self.create_interior_widgets(panel)
 
         self.sizer = self.__arrange_boxes()
         panel.SetSizer(self.sizer)
-        self.sizer.Fit(panel)
-        self.Fit()
 
     def __arrange_boxes(self):
-        """Arranges the lower and upper parts of the main window into a
-        vertical stack"""
+        """Arranges the document tabs and the buttons into a vertical
+        stack"""
         proportion = 0
-        text_proportion = 1
+        notebook_proportion = 1
         box = wx.BoxSizer(wx.VERTICAL)
-        box.Add(self.img, proportion, wx.EXPAND)
+        box.Add(self.notebook, notebook_proportion, wx.EXPAND)
         buttons = wx.BoxSizer(wx.HORIZONTAL)
         buttons.AddStretchSpacer()
         buttons.Add(self.save_button, proportion, wx.ALIGN_LEFT)
         buttons.Add(self.eval_button, proportion, wx.ALIGN_RIGHT)
+        buttons.Add(self.live_preview, proportion,
+                    wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 10)
         buttons.AddStretchSpacer()
-        box.Add(buttons, proportion, wx.EXPAND)
-        box.Add((-1, 10))
-        box.Add(self.control, text_proportion, wx.EXPAND | wx.ALL, 10)
+        box.Add(buttons, proportion, wx.EXPAND | wx.BOTTOM, 10)
         return box
 
     def create_interior_widgets(self, panel):
         """Creates interior window components, i.e. everything except status
         and menu bars."""
-        self.control = wx.TextCtrl(
-            panel, -1, START_DIAG, style=wx.TE_MULTILINE | wx.EXPAND)
+        self.notebook = wx.Notebook(panel, -1)
         self.save_button = wx.Button(panel, wx.ID_SAVE)
         self.eval_button = wx.Button(panel, label='Evaluate')
-        ## TODO: refactor into Model method ?
-        png = seqdiagrams.diagram2png(
-            seqdiagrams.text2diagram(self.control.GetValue()))
-        stream = wx.InputStream(cStringIO.StringIO(png))
-        png = wx.ImageFromStream(stream)
-        self.width = png.GetWidth()
-        self.height = png.GetHeight()
-        self.img = wx.StaticBitmap(
-            panel, -1, png.ConvertToBitmap(), (self.width, self.height))
+        self.live_preview = wx.CheckBox(panel, label='Live preview')
+
+    def add_page(self, document, text=START_DIAG):
+        """Opens a tab for a document and brings it to the front"""
+        page = DocumentPanel(self.notebook, document, text)
+        self.notebook.AddPage(page, document.filename, select=True)
+        if self.notebook.GetPageCount() == 1:
+            self.sizer.Fit(self.notebook.GetParent())
+            self.Fit()
+        return page
+
+    def remove_page(self, page):
+        """Closes the tab of a document"""
+        self.notebook.DeletePage(self.pages().index(page))
+
+    def pages(self):
+        """Returns the panels of every open document"""
+        return [self.notebook.GetPage(index)
+                for index in range(self.notebook.GetPageCount())]
+
+    @property
+    def page(self):
+        """The panel of the document in front, or None"""
+        index = self.notebook.GetSelection()
+        return self.notebook.GetPage(index) if index >= 0 else None
+
+    @property
+    def control(self):
+        """The text control of the document in front"""
+        return self.page.control
+
+    @property
+    def img(self):
+        """The diagram canvas of the document in front"""
+        return self.page.img
+
+    @property
+    def raster(self):
+        """The raster of the document in front"""
+        return self.page.raster
 
 
 class HtmlWindow(wx.html.HtmlWindow):
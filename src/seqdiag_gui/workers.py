@@ -0,0 +1,136 @@
+# Copyright (C) 2013 Luis Osa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File:
+    workers.py
+Author:
+    Luis Osa <logc>
+Description:
+    Background workers that render diagrams away from the GUI thread. This
+    module does not depend on wx; callbacks are responsible for handing the
+    results back to the GUI.
+"""
+import Queue
+import threading
+
+import seqdiagrams
+from instrumentation import INSTRUMENTS
+from traces import import_trace
+
+
+class RenderWorker(threading.Thread):
+    """Renders submitted texts one at a time on a background thread. Every
+    submission starts a new generation: queued jobs of older generations are
+    dropped, and a render that finishes after a newer submission is not
+    reported."""
+
+    def __init__(self, render=seqdiagrams.text2png):
+        super(RenderWorker, self).__init__(name='RenderWorker')
+        self.daemon = True
+        self.render = render
+        self._jobs = Queue.Queue()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def submit(self, text, callback, render=None, preview=None):
+        """Queues a text for rendering and returns its generation. Once the
+        render finishes, `callback` is called on the worker thread with the
+        generation and the result. `render` replaces the worker's render
+        function for this job. If `preview` is given, the render function is
+        also passed a function to report an early result with, which calls
+        `preview` with the generation and that result, and returns False
+        once the job is stale."""
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        self._jobs.put((generation, text, callback, render or self.render,
+                        preview))
+        return generation
+
+    def cancel(self):
+        """Discards every pending and running job"""
+        with self._lock:
+            self._generation += 1
+
+    def is_current(self, generation):
+        """Returns whether no newer job was submitted after `generation`"""
+        with self._lock:
+            return generation == self._generation
+
+    def stop(self):
+        """Asks the worker thread to finish after its current job"""
+        self.cancel()
+        self._jobs.put(None)
+
+    def run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            generation, text, callback, render, preview = job
+            if not self.is_current(generation):
+                continue
+            args = (text,)
+            if preview is not None:
+                args += (self._reporter(generation, preview),)
+            INSTRUMENTS.begin_render()
+            try:
+                result = INSTRUMENTS.call(render, *args)
+            except Exception:
+                result = None
+            if self.is_current(generation):
+                callback(generation, result)
+
+    def _reporter(self, generation, preview):
+        """Returns the function a render reports its early results with"""
+        def report(*result):
+            if not self.is_current(generation):
+                return False
+            preview(generation, result)
+            return True
+        return report
+
+    def _next_job(self):
+        """Blocks for a job, then skips ahead to the most recent one queued"""
+        job = self._jobs.get()
+        while job is not None:
+            try:
+                job = self._jobs.get_nowait()
+            except Queue.Empty:
+                break
+        return job
+
+
+class ImportWorker(threading.Thread):
+    """Imports a trace into windowed diagram sources on a background thread.
+    `progress` is called with the number of windows written, and `done` with
+    the error that stopped the import and the index of the windows."""
+
+    def __init__(self, path, output_dir, progress, done):
+        super(ImportWorker, self).__init__(name='ImportWorker')
+        self.daemon = True
+        self.path = path
+        self.output_dir = output_dir
+        self.progress = progress
+        self.done = done
+
+    def run(self):
+        try:
+            index = import_trace(self.path, self.output_dir,
+                                 progress=self.progress)
+        except Exception as error:
+            self.done(error, None)
+        else:
+            self.done(None, index)